@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Batch driver for many mzML files
+
+    Usage: batch.py <manifest.csv|manifest.json> [workers] [search_workers]
+
+    The manifest lists one run per row with mzml_file, database_file and
+    optionally out_folder.
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import sys
+import csv
+import json
+import codecs
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import ligandum
+import matcher
+import storage
+
+
+# library and per run molecules shared by the forked quantification workers
+_batch_library = None
+_batch_molecules = None
+
+
+def read_manifest(manifest_file):
+    if manifest_file.endswith('.json'):
+        with open(manifest_file, 'r') as io:
+            runs = json.load(io)
+    else:
+        with codecs.open(manifest_file, mode = 'r', encoding = 'utf-8') as io:
+            runs = list(csv.DictReader(io))
+
+    for run in runs:
+        if run.get('out_folder', '') in ('', None):
+            run['out_folder'] = os.path.splitext(run['mzml_file'])[0] + '_ligandum'
+    return runs
+
+
+def _identify_run(run, cache_folder, target_decoy_database):
+    # every search engine gets one core
+    return ligandum.msms_identification(
+        run['mzml_file'],
+        run['database_file'],
+        cache_folder          = cache_folder,
+        target_decoy_database = target_decoy_database,
+        cpus                  = 1
+    )
+
+
+def _run_results(results, evidence_lookup):
+    # the shared library holds the molecules of all runs; only formulas with
+    # evidences in this run are kept and the run's own evidence lookup sets
+    # their RT windows and MS2 flags
+    run_results = matcher.empty_results(_batch_library)
+    run_results.lookup = dict(run_results.lookup, **{'formula to evidences': evidence_lookup})
+    return matcher.add_matches(
+        run_results,
+        ((key, value['data']) for key, value in results.items() if key.formula in evidence_lookup)
+    )
+
+
+def _quantify_run(run_index):
+    run, n = run_index
+    formatted_fixed_labels, evidence_lookup, molecule_list = _batch_molecules[n]
+    out_folder = run['out_folder']
+    os.makedirs(out_folder, exist_ok = True)
+
+    results = _run_results(
+        ligandum.ligandability_quantification(
+            run['mzml_file'],
+            molecule_list,
+            evidence_lookup,
+            formatted_fixed_labels,
+            lib = _batch_library
+        ),
+        evidence_lookup
+    )
+    storage.save_results(results, os.path.join(out_folder, 'pyQms_results'))
+
+    quant_summary_file, result_csv_file = ligandum.quantify_windows(
+        results,
+        os.path.join(out_folder, 'quant_summary.csv'),
+        os.path.join(out_folder, 'ligand_quant_res.csv')
+    )
+    os.makedirs(os.path.join(out_folder, 'plots'), exist_ok = True)
+    ligandum.calculate_ligandability_ratios(
+        results,
+        quant_summary_file,
+        result_csv_file,
+        os.path.join(out_folder, 'ratios'),
+        plot_file_name = os.path.join(out_folder, 'plots', 'plot_{0}_{1}.pdf')
+    )
+    return out_folder
+
+
+def run_batch(
+        manifest_file,
+        workers        = None,
+        search_workers = None,
+        cache_folder   = None
+            ):
+
+    global _batch_library
+    global _batch_molecules
+
+    if workers is None:
+        workers = os.cpu_count()
+    if search_workers is None:
+        search_workers = workers
+
+    runs = read_manifest(manifest_file)
+    if len(runs) == 0:
+        return []
+    if cache_folder is None:
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(manifest_file)), 'ligandum_cache')
+    cache = ligandum.StageCache(cache_folder)
+
+    # one target decoy database per distinct database file
+    target_decoy_databases = {}
+    for run in runs:
+        if run['database_file'] not in target_decoy_databases:
+            target_decoy_databases[run['database_file']] = ligandum.generate_target_decoy_database(
+                run['database_file'],
+                cache
+            )
+
+    # identification, at most search_workers search engines at a time
+    with ProcessPoolExecutor(max_workers = search_workers) as pool:
+        futures = [
+            pool.submit(_identify_run, run, cache_folder, target_decoy_databases[run['database_file']])
+            for run in runs
+        ]
+        evidence_files = [future.result() for future in futures]
+
+    # molecules and evidences per run; one isotopologue library over the
+    # molecules of all runs is built once and inherited by the forked
+    # quantification workers
+    _batch_molecules = [ligandum.prepare_molecules([evidence_file]) for evidence_file in evidence_files]
+    molecule_list = []
+    known_molecules = set()
+    evidence_lookup = {}
+    for formatted_fixed_labels, run_evidence_lookup, run_molecule_list in _batch_molecules:
+        for molecule in run_molecule_list:
+            if molecule not in known_molecules:
+                molecule_list.append(molecule)
+                known_molecules.add(molecule)
+        matcher.merge_lookup(evidence_lookup, run_evidence_lookup)
+    _batch_library = matcher.build_library(
+        ligandum.get_library_params(molecule_list, evidence_lookup, formatted_fixed_labels),
+        ligandum.quantification_params,
+        cache_folder = os.path.join(cache_folder, 'libraries')
+    )
+
+    with multiprocessing.get_context('fork').Pool(processes = max(1, min(workers, len(runs)))) as pool:
+        out_folders = pool.map(_quantify_run, [(run, n) for n, run in enumerate(runs)], chunksize = 1)
+
+    return out_folders
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(1)
+    run_batch(
+        sys.argv[1],
+        workers        = int(sys.argv[2]) if len(sys.argv) > 2 else None,
+        search_workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    )
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Benchmarks of the quantification hot paths on synthetic data
+
+    Usage: benchmark.py <folder> [scale] [baseline.json]
+
+    A cysteine labelled data set (evidence csv and MS1 mzML) of the given
+    scale (small, medium or large) is generated in folder, every hot path is
+    run on it and timings and peak memory are written to folder. If a
+    baseline is given, slower or larger results are reported as regressions.
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import sys
+import csv
+import json
+import time
+import base64
+import codecs
+import numpy as np
+import pyqms
+import ligandum
+import profiler
+from ratios import Ratios
+
+
+# n_peptides: labelled peptides, n_spectra: MS1 spectra over the gradient
+scales = {
+    'small' : {'n_peptides': 100, 'n_spectra': 500, 'n_plots': 20},
+    'medium': {'n_peptides': 1000, 'n_spectra': 3000, 'n_plots': 100},
+    'large' : {'n_peptides': 5000, 'n_spectra': 10000, 'n_plots': 500}
+}
+
+# GRADIENT: minutes covered by the MS1 spectra, PEAK_WIDTH: sigma of the
+# elution profiles in minutes, NOISE_PEAKS: random peaks per spectrum,
+# PARTNER_DROPOUT: fraction of pairs where only one label has MS2 evidence
+default_params = {
+    'GRADIENT'       : 60.0,
+    'PEAK_WIDTH'     : 0.1,
+    'NOISE_PEAKS'    : 200,
+    'PARTNER_DROPOUT': 0.3,
+    'CHARGES'        : [2, 3],
+    'SEED'           : 0
+}
+
+# light and heavy cysteine labels of the synthetic data; unlike the TEV tags
+# of ligandum.default_labels both are in the unimod.xml bundled with pyqms,
+# so the benchmark runs without a local unimod. The first label carries the
+# ratio, as in ligandum.default_labels.
+benchmark_labels = [
+    {
+        'name'       : 'Propionamide',
+        'mass'       : '71.037114',
+        'composition': {'C': 3, 'H': 5, 'N': 1, 'O': 1}
+    },
+    {
+        'name'       : 'Carbamidomethyl',
+        'mass'       : '57.021464',
+        'composition': {'C': 2, 'H': 3, 'N': 1, 'O': 1}
+    }
+]
+
+# a result is a regression if it is this much slower or larger than the baseline
+REGRESSION_TOLERANCE = 0.2
+
+AMINO_ACIDS = 'ADEFGHILNPQSTVWY'
+
+EVIDENCE_FIELDS = [
+    'Spectrum ID',
+    'Spectrum Title',
+    'Sequence',
+    'Modifications',
+    'Charge',
+    'Retention Time (s)',
+    'Protein ID',
+    'PEP',
+    'q-value',
+    'Is decoy'
+]
+
+MZML_HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0" id="{0}">
+  <cvList count="2">
+    <cv id="MS" fullName="Proteomics Standards Initiative Mass Spectrometry Ontology" URI="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"/>
+    <cv id="UO" fullName="Unit Ontology" URI="https://raw.githubusercontent.com/bio-ontology-research-group/unit-ontology/master/unit.obo"/>
+  </cvList>
+  <run id="{0}">
+    <spectrumList count="{1}" defaultDataProcessingRef="synthetic">
+'''
+
+MZML_SPECTRUM = '''      <spectrum index="{0}" id="controllerType=0 controllerNumber=1 scan={1}" defaultArrayLength="{2}">
+        <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="1"/>
+        <cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum" value=""/>
+        <scanList count="1">
+          <cvParam cvRef="MS" accession="MS:1000795" name="no combination" value=""/>
+          <scan>
+            <cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{3}" unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"/>
+          </scan>
+        </scanList>
+        <binaryDataArrayList count="2">
+          <binaryDataArray encodedLength="{4}">
+            <cvParam cvRef="MS" accession="MS:1000523" name="64-bit float" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000576" name="no compression" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000514" name="m/z array" value="" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/>
+            <binary>{5}</binary>
+          </binaryDataArray>
+          <binaryDataArray encodedLength="{6}">
+            <cvParam cvRef="MS" accession="MS:1000523" name="64-bit float" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000576" name="no compression" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000515" name="intensity array" value="" unitCvRef="MS" unitAccession="MS:1000131" unitName="number of detector counts"/>
+            <binary>{7}</binary>
+          </binaryDataArray>
+        </binaryDataArrayList>
+      </spectrum>
+'''
+
+MZML_FOOTER = '''    </spectrumList>
+  </run>
+</mzML>
+'''
+
+
+def synthetic_peptides(n_peptides, gradient, random_state):
+    # random tryptic peptides with one labelled cysteine and their heavy to
+    # light ratio, elution apex and abundance
+    peptides = []
+    for n in range(n_peptides):
+        length = random_state.randint(7, 20)
+        sequence = list(random_state.choice(list(AMINO_ACIDS), length))
+        position = random_state.randint(1, length)
+        sequence[position - 1] = 'C'
+        sequence.append('K')
+        peptides.append({
+            'sequence'    : ''.join(sequence),
+            'position'    : position,
+            'protein'     : 'SYN{0:05d}'.format(n // 5),
+            'ratio'       : float(np.exp(random_state.normal(0., 1.))),
+            'apex'        : float(random_state.uniform(1., gradient - 1.)),
+            'abundance'   : float(10 ** random_state.uniform(5, 8))
+        })
+    return peptides
+
+
+def molecule_name(peptide, label_name):
+    return '{0}#{1}:{2}'.format(peptide['sequence'], label_name, peptide['position'])
+
+
+def write_evidences(evidence_file, peptides, labels, params, random_state):
+    label_names = [label['name'] for label in labels]
+    lines = []
+    for n, peptide in enumerate(peptides):
+        evidence_labels = list(label_names)
+        if random_state.uniform() < params['PARTNER_DROPOUT']:
+            evidence_labels = [evidence_labels[random_state.randint(len(evidence_labels))]]
+        for label_name in evidence_labels:
+            rt = peptide['apex'] + random_state.normal(0., params['PEAK_WIDTH'])
+            lines.append({
+                'Spectrum ID'       : len(lines) + 1,
+                'Spectrum Title'    : 'synthetic.{0}.{0}.2'.format(len(lines) + 1),
+                'Sequence'          : peptide['sequence'],
+                'Modifications'     : '{0}:{1}'.format(label_name, peptide['position']),
+                'Charge'            : params['CHARGES'][n % len(params['CHARGES'])],
+                'Retention Time (s)': rt * 60.,
+                'Protein ID'        : peptide['protein'],
+                'PEP'               : float(10 ** random_state.uniform(-6, -2)),
+                'q-value'           : 0.0,
+                'Is decoy'          : 'false'
+            })
+
+    with codecs.open(evidence_file, mode = 'w', encoding = 'utf-8') as io:
+        dict_writer = csv.DictWriter(io, fieldnames = EVIDENCE_FIELDS)
+        dict_writer.writeheader()
+        dict_writer.writerows(lines)
+    return evidence_file
+
+
+def isotope_envelopes(peptides, labels, charges):
+    # mz, relative intensity, peptide index and label intensity factor of
+    # every isotopologue peak of every labelled molecule
+    label_names = [label['name'] for label in labels]
+    molecules = [molecule_name(peptide, label_name) for peptide in peptides for label_name in label_names]
+    lib = pyqms.IsotopologueLibrary(molecules = molecules, charges = charges, verbose = False)
+    molecule_to_formula = lib.lookup['molecule to formula']
+
+    mz = []
+    i = []
+    peptide_ids = []
+    factors = []
+    for n, peptide in enumerate(peptides):
+        for label_name in label_names:
+            # the first label carries the ratio
+            factor = peptide['ratio'] if label_name == label_names[0] else 1.
+            entry = lib[molecule_to_formula[molecule_name(peptide, label_name)]]
+            label_percentiles = sorted(entry['env'].keys())[0]
+            for charge in charges:
+                envelope = entry['env'][label_percentiles][charge]
+                mz.extend(envelope['mz'])
+                i.extend(entry['env'][label_percentiles]['relabun'])
+                peptide_ids.extend([n] * len(envelope['mz']))
+                factors.extend([factor] * len(envelope['mz']))
+
+    return np.array(mz), np.array(i), np.array(peptide_ids), np.array(factors)
+
+
+def write_mzml(mzml_file, peptides, labels, n_spectra, params, random_state):
+    mz, relative_i, peptide_ids, factors = isotope_envelopes(peptides, labels, params['CHARGES'])
+    apex = np.array([peptide['apex'] for peptide in peptides])[peptide_ids]
+    intensity = np.array([peptide['abundance'] for peptide in peptides])[peptide_ids] * relative_i * factors
+    order = np.argsort(apex)
+    mz, apex, intensity = mz[order], apex[order], intensity[order]
+
+    width = params['PEAK_WIDTH']
+    rts = np.linspace(0., params['GRADIENT'], n_spectra)
+    with open(mzml_file, 'w') as io:
+        io.write(MZML_HEADER.format(os.path.splitext(os.path.basename(mzml_file))[0], n_spectra))
+        for n, rt in enumerate(rts.tolist()):
+            # only peaks eluting within four sigma of this spectrum
+            first, last = np.searchsorted(apex, [rt - 4 * width, rt + 4 * width])
+            spectrum_i = intensity[first:last] * np.exp(-0.5 * ((rt - apex[first:last]) / width) ** 2)
+            noise_mz = random_state.uniform(300., 1800., params['NOISE_PEAKS'])
+            noise_i = 10 ** random_state.uniform(3, 5, params['NOISE_PEAKS'])
+
+            spectrum_mz = np.concatenate([mz[first:last], noise_mz])
+            spectrum_i = np.concatenate([spectrum_i, noise_i])
+            spectrum_order = np.argsort(spectrum_mz)
+            encoded_mz = base64.b64encode(spectrum_mz[spectrum_order].astype('<f8').tobytes()).decode('ascii')
+            encoded_i = base64.b64encode(spectrum_i[spectrum_order].astype('<f8').tobytes()).decode('ascii')
+            io.write(MZML_SPECTRUM.format(
+                n,
+                n + 1,
+                len(spectrum_mz),
+                rt,
+                len(encoded_mz),
+                encoded_mz,
+                len(encoded_i),
+                encoded_i
+            ))
+        io.write(MZML_FOOTER)
+    return mzml_file
+
+
+def generate_dataset(
+        folder,
+        n_peptides,
+        n_spectra,
+        labels = None,
+        params = None
+            ):
+
+    # writes synthetic.mzML and synthetic_evidences.csv, returns their paths;
+    # the same params and seed always give the same files
+    if labels is None:
+        labels = benchmark_labels
+    params = dict(default_params, **(params or {}))
+    random_state = np.random.RandomState(params['SEED'])
+    os.makedirs(folder, exist_ok = True)
+
+    peptides = synthetic_peptides(n_peptides, params['GRADIENT'], random_state)
+
+    evidence_file = write_evidences(
+        os.path.join(folder, 'synthetic_evidences.csv'),
+        peptides,
+        labels,
+        params,
+        random_state
+    )
+    mzml_file = write_mzml(
+        os.path.join(folder, 'synthetic.mzML'),
+        peptides,
+        labels,
+        n_spectra,
+        params,
+        random_state
+    )
+    return mzml_file, evidence_file
+
+
+def run_benchmarks(folder, scale = 'small', params = None):
+    # every hot path runs in its own profiler stage; returns the profile
+    scale_params = scales[scale]
+    label_names = [label['name'] for label in benchmark_labels]
+    mzml_file, evidence_file = generate_dataset(
+        folder,
+        scale_params['n_peptides'],
+        scale_params['n_spectra'],
+        params = params
+    )
+
+    pyqms.params.update(ligandum.quantification_params)
+    profile = profiler.start('benchmark_{0}'.format(scale))
+    try:
+        formatted_fixed_labels, evidence_lookup, molecule_list = pyqms.adaptors.parse_evidence(
+            fixed_labels         = None,
+            evidence_files       = [evidence_file],
+            evidence_score_field = 'PEP'
+        )
+        with profiler.stage('edit_molecule_list'):
+            ligandum.edit_molecule_list(molecule_list, evidence_lookup, benchmark_labels)
+            profiler.count('molecules', len(molecule_list))
+
+        with profiler.stage('ligandability_quantification'):
+            results = ligandum.ligandability_quantification(
+                mzml_file,
+                molecule_list,
+                evidence_lookup,
+                formatted_fixed_labels,
+                reader = None
+            )
+
+        quant_summary_file, result_csv_file = ligandum.quantify_windows(
+            results,
+            os.path.join(folder, 'quant_summary.csv'),
+            os.path.join(folder, 'ligand_quant_res.csv')
+        )
+
+        with profiler.stage('read_and_parse_files'):
+            rs = Ratios(quant_summary_file, result_csv_file, results, label_names)
+            rs.read_and_parse_files()
+            profiler.count('keys', len(rs))
+
+        with profiler.stage('calculate_ratios'):
+            ratios = sorted(rs.calculate_ratios(label_names[0], label_names[1], 'max I in window'))
+            profiler.count('ratios', len(ratios))
+
+        with profiler.stage('plot_pairs'):
+            key_list = [key for key, ratio in ratios[:scale_params['n_plots']]]
+            rs.plot_pairs(
+                key_list,
+                os.path.join(folder, 'plots.pdf'),
+                {label_name: n for n, label_name in enumerate(label_names)}
+            )
+            profiler.count('plots', len(key_list))
+    finally:
+        profiler.stop()
+
+    return profile
+
+
+def summarize(profile):
+    # top level stages only, name -> seconds and peak RSS
+    return {
+        record['name']: {
+            'seconds' : record['seconds'],
+            'peak_rss': record['peak_rss']
+        }
+        for record in profile.stages if record['parent'] is None
+    }
+
+
+def compare(summary, baseline_summary, tolerance = None):
+    # returns (stage, measure, baseline value, value) for every regression
+    if tolerance is None:
+        tolerance = REGRESSION_TOLERANCE
+    regressions = []
+    for name, measures in summary.items():
+        for measure, value in measures.items():
+            baseline_value = baseline_summary.get(name, {}).get(measure, None)
+            if value is None or baseline_value is None:
+                continue
+            if value > baseline_value * (1 + tolerance):
+                regressions.append((name, measure, baseline_value, value))
+    return regressions
+
+
+def main(folder, scale = 'small', baseline_file = None):
+    profile = run_benchmarks(folder, scale)
+    profile.report()
+
+    summary = summarize(profile)
+    result_file = os.path.join(folder, 'benchmark_{0}_{1}.json'.format(scale, time.strftime('%Y%m%d_%H%M%S')))
+    with open(result_file, 'w') as io:
+        json.dump({'scale': scale, 'summary': summary, 'profile': profile.to_dict()}, io, indent = 2, default = str)
+    print('> Benchmark written to {0}'.format(result_file))
+
+    if baseline_file is None:
+        return []
+    with open(baseline_file, 'r') as io:
+        baseline = json.load(io)
+    if baseline['scale'] != scale:
+        print('Baseline was recorded at scale {0}, not {1}'.format(baseline['scale'], scale))
+    regressions = compare(summary, baseline['summary'])
+    for name, measure, baseline_value, value in regressions:
+        print('> Regression in {0}: {1} {2:.3g} -> {3:.3g}'.format(name, measure, baseline_value, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(1)
+    regressions = main(
+        sys.argv[1],
+        scale         = sys.argv[2] if len(sys.argv) > 2 else 'small',
+        baseline_file = sys.argv[3] if len(sys.argv) > 3 else None
+    )
+    exit(1 if len(regressions) > 0 else 0)
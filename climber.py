@@ -1,22 +1,202 @@
 #!/usr/bin/env python3
 # encoding: utf-8
+"""
+    Ligandum
+    -----
 
+    Chromatographic peak boundary detection starting from MS2 evidences
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import csv
+import codecs
+import numpy as np
+from ratios import index_results
+
+
+# INTENSITY_PERCENTILE: a peak ends where the intensity drops below this
+# fraction of its apex
+# RT_OFFSET_TO_MS2: the apex is searched within this many minutes around
+# the MS2 evidences
 default_params = {
         'INTENSITY_PERCENTILE': 0.5,
         'RT_OFFSET_TO_MS2'    : 1
     }
 
 class Climber:
-    
+
     def __init__(
             self,
             params = None
                 ):
-        
+
         if params is None:
             self.params = default_params
         else:
             self.params = params
-        
-        pass
-    return
\ No newline at end of file
+
+        return
+
+
+    def climb(
+            self,
+            rt,
+            i,
+            offsets,
+            evidence_rt_min,
+            evidence_rt_max = None
+                ):
+
+        # profile n spans rt/i[offsets[n]:offsets[n + 1]]; returns start and
+        # stop RT of every profile, nan where no apex is found near the evidence
+        rt = np.asarray(rt, dtype = np.float64)
+        i = np.asarray(i, dtype = np.float64)
+        offsets = np.asarray(offsets, dtype = np.int64)
+        evidence_rt_min = np.asarray(evidence_rt_min, dtype = np.float64)
+        if evidence_rt_max is None:
+            evidence_rt_max = evidence_rt_min
+        evidence_rt_max = np.asarray(evidence_rt_max, dtype = np.float64)
+
+        n_profiles = len(offsets) - 1
+        starts = np.full(n_profiles, np.nan)
+        stops = np.full(n_profiles, np.nan)
+
+        lengths = np.diff(offsets)
+        has_data = lengths > 0
+        if not has_data.any():
+            return starts, stops
+
+        first, last = offsets[0], offsets[-1]
+        segments = np.repeat(np.arange(n_profiles)[has_data], lengths[has_data])
+
+        # profiles have to be sorted by RT
+        order = np.lexsort((rt[first:last], segments))
+        rt = rt[first:last][order]
+        i = i[first:last][order]
+        profile_starts = offsets[:-1][has_data] - first
+        profile_stops = offsets[1:][has_data] - first
+        n_points = len(i)
+        index = np.arange(n_points)
+
+        # apex: highest point within RT_OFFSET_TO_MS2 of the evidences
+        rt_offset = self.params['RT_OFFSET_TO_MS2']
+        near_evidence = (
+            (rt >= evidence_rt_min[segments] - rt_offset) &
+            (rt <= evidence_rt_max[segments] + rt_offset)
+        )
+        apex_i = np.maximum.reduceat(np.where(near_evidence, i, -np.inf), profile_starts)
+        found = np.isfinite(apex_i)
+        apex_per_point = np.repeat(apex_i, lengths[has_data])
+        candidates = np.where(near_evidence & (i == apex_per_point), index, n_points)
+        apex = np.minimum.reduceat(candidates, profile_starts)
+        apex = np.minimum(apex, n_points - 1)
+
+        # the apex has to be a local maximum, not a slope that is cut by the
+        # evidence range
+        previous_i = np.where(apex > profile_starts, i[np.maximum(apex - 1, 0)], -np.inf)
+        next_i = np.where(apex < profile_stops - 1, i[np.minimum(apex + 1, n_points - 1)], -np.inf)
+        found &= (i[apex] >= previous_i) & (i[apex] >= next_i)
+
+        # climb down on both sides until the intensity drops below the threshold
+        below = i < apex_per_point * self.params['INTENSITY_PERCENTILE']
+        last_below = np.maximum.accumulate(np.where(below, index, -1))
+        next_below = np.minimum.accumulate(np.where(below, index, n_points)[::-1])[::-1]
+
+        left = np.maximum(last_below[apex] + 1, profile_starts)
+        right = np.minimum(next_below[apex] - 1, profile_stops - 1)
+
+        profile_ids = np.flatnonzero(has_data)[found]
+        starts[profile_ids] = rt[left[found]]
+        stops[profile_ids] = rt[right[found]]
+
+        return starts, stops
+
+
+    def climb_profiles(
+            self,
+            profiles,
+            evidence_rts
+                ):
+
+        # profiles: list of (rt list, intensity list), evidence_rts: list of
+        # lists of MS2 RTs; returns (start, stop) or None per profile
+        offsets = np.zeros(len(profiles) + 1, dtype = np.int64)
+        for n, (profile_rt, profile_i) in enumerate(profiles):
+            offsets[n + 1] = offsets[n] + len(profile_rt)
+        rt = np.concatenate([np.zeros(0)] + [np.asarray(profile_rt, dtype = np.float64) for profile_rt, profile_i in profiles])
+        i = np.concatenate([np.zeros(0)] + [np.asarray(profile_i, dtype = np.float64) for profile_rt, profile_i in profiles])
+
+        evidence_rt_min = np.array([min(rts) if len(rts) > 0 else np.nan for rts in evidence_rts])
+        evidence_rt_max = np.array([max(rts) if len(rts) > 0 else np.nan for rts in evidence_rts])
+
+        starts, stops = self.climb(rt, i, offsets, evidence_rt_min, evidence_rt_max)
+
+        windows = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            if np.isnan(start):
+                windows.append(None)
+            else:
+                windows.append((start, stop))
+        return windows
+
+
+    def refine_rt_info_file(
+            self,
+            results_class,
+            rt_info_file,
+            output_file = None
+                ):
+
+        # replaces start (min) and stop (min) of a pyQms rt info file with the
+        # climbed peak boundaries; rows without a peak keep their window
+        if output_file is None:
+            output_file = rt_info_file
+
+        with codecs.open(rt_info_file, mode = 'r', encoding = 'utf-8') as rif:
+            dict_reader = csv.DictReader(rif)
+            fieldnames = dict_reader.fieldnames
+            lines = list(dict_reader)
+
+        results_index = index_results(results_class)
+        profiles = []
+        evidence_rts = []
+        for line in lines:
+            matches = results_index.get((line['file_name'], line['formula'], int(line['charge'])), [])
+            profiles.append((
+                [entry.rt for entry in matches],
+                [entry.scaling_factor for entry in matches]
+            ))
+            evidence_rts.append(self._parse_evidence_rts(line['evidences (min)']))
+
+        n_refined = 0
+        for line, window in zip(lines, self.climb_profiles(profiles, evidence_rts)):
+            if window is not None:
+                line['start (min)'], line['stop (min)'] = window
+                n_refined += 1
+
+        with codecs.open(output_file, mode = 'w', encoding = 'utf-8') as rif:
+            dict_writer = csv.DictWriter(rif, fieldnames = fieldnames)
+            dict_writer.writeheader()
+            dict_writer.writerows(lines)
+
+        print('> Climbed peak boundaries for {0} of {1} molecules'.format(n_refined, len(lines)))
+        return output_file
+
+
+    def _parse_evidence_rts(
+            self,
+            evidences
+                ):
+
+        rts = []
+        for evidence in evidences.split(';'):
+            try:
+                rts.append(float(evidence[evidence.find('@')+1:]))
+            except ValueError:
+                pass
+        return rts
@@ -7,14 +7,77 @@ Created by Matthias Stahl at TU Muenchen, 2017
 '''
 
 import ursgal
-import pymzml
 import pyqms
-import pickle
 import os
-import numpy as np
-from ratios import Ratios
+import functools
+import threading
+import matcher
+import profiler
+import pipeline
+from ratios import Ratios, split_molecule
+from quantification import calc_auc
+from climber import Climber
+from stage_cache import StageCache, run_stage
 from locale import *
 
+try:
+    from chemical_composition import ChemicalComposition
+except ImportError:
+    # pyqms before 0.6 ships its own
+    ChemicalComposition = pyqms.ChemicalComposition
+
+
+default_labels = [
+    {
+        'name': 'TEV_H',
+        'mass': '567.30982',
+        'composition': {'C': 21, '13C': 4, 'H': 39, 'N': 7, '15N': 2, 'O': 6}
+    },
+    {
+        'name': 'TEV_L',
+        'mass': '561.30233',
+        'composition': {'C': 25, 'H': 39, 'N': 9, 'O': 6}
+    }
+]
+
+identification_params = {
+    'enzyme': 'trypsin',
+    'frag_mass_tolerance': 20,
+    'frag_method': 'hcd',
+    'frag_mass_tolerance_unit': 'ppm',
+    'max_missed_cleavages': 2,
+    'decoy_generation_mode' : 'reverse_protein',
+    'precursor_mass_tolerance_minus': 10,
+    'precursor_mass_tolerance_plus': 10,
+    'precursor_mass_tolerance_unit': 'ppm',
+    'precursor_min_charge' : '2',
+    'modifications' : [
+        'M,opt,any,Oxidation',
+        'C,fix,any,Carbamidomethyl',
+        'K,opt,any,TEV_H,C(21)13C(4)H(39)N(7)15N(2)O(6)',
+        'K,opt,any,TEV_L,C(25)H(39)N(9)O(6)'
+    ],
+}
+
+filter_params = {
+    'csv_filter_rules': [
+        ['q-value', 'lte', 0.000000001],
+        ['Is decoy', 'equals', 'false']
+    ]
+}
+
+search_engine = 'msgfplus_v2016_09_16'
+validation_engine = 'percolator_2_08'
+
+quantification_params = {
+    'MACHINE_OFFSET_IN_PPM'                   : 10.0,
+    'REL_MZ_RANGE'                            : 1e-05,
+    'MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES' : 2,
+    'REQUIRED_PERCENTILE_PEAK_OVERLAP'        : 0.7,
+    'M_SCORE_THRESHOLD'                       : 0.0,
+    'MZ_SCORE_PERCENTILE'                     : 0.4
+}
+
 
 def showStartHello():
     print('{0:-^100}'.format('###'))
@@ -39,155 +102,277 @@ def new_userdefined_unimod_molecule(mass, name, composition):
     return
 
     
-def msms_identification(mzml_file, database_file):
-    # define parameters
-    params = {
-        'enzyme': 'trypsin',
-        'frag_mass_tolerance': 20,
-        'frag_method': 'hcd',
-        'frag_mass_tolerance_unit': 'ppm',
-        'max_missed_cleavages': 2,
-        'decoy_generation_mode' : 'reverse_protein',
-        'precursor_mass_tolerance_minus': 10,
-        'precursor_mass_tolerance_plus': 10,
-        'precursor_mass_tolerance_unit': 'ppm',
-        'precursor_min_charge' : '2',
-        'modifications' : [
-            'M,opt,any,Oxidation',
-            'C,fix,any,Carbamidomethyl',
-            'K,opt,any,TEV_H,C(21)13C(4)H(39)N(7)15N(2)O(6)',
-            'K,opt,any,TEV_L,C(25)H(39)N(9)O(6)'
-        ],
-    }
-    
-    # initialize Ursgal controller
+def generate_target_decoy_database(database_file, cache = None):
     uc = ursgal.UController(
-        params = params
+        params = identification_params
     )
+    # named after the database, so that databases of a batch do not
+    # overwrite each other
+    target_decoy_file = '{0}_target_decoy.fasta'.format(os.path.splitext(database_file)[0])
     
     # generate reverse protein sequences and initialize new database
-    new_target_decoy_db_name = uc.generate_target_decoy(
-        input_files = database_file,
-        output_file_name = 'new_target_decoy.fasta',
-    )
+    with profiler.stage('target_decoy'):
+        new_target_decoy_db_name = run_stage(
+            cache,
+            'target_decoy',
+            [database_file],
+            identification_params,
+            uc.generate_target_decoy,
+            input_files = database_file,
+            output_file_name = target_decoy_file,
+        )
     print('Generated target decoy database: {0}'.format(new_target_decoy_db_name))
-    uc.params['database'] = new_target_decoy_db_name
+    return new_target_decoy_db_name
+
+
+def msms_identification(mzml_file, database_file, cache_folder = None, target_decoy_database = None, cpus = None):
+    # with a cache folder, stages whose input files and params are unchanged
+    # are skipped and their stored outputs are reused
+    cache = None
+    if cache_folder is not None:
+        cache = StageCache(cache_folder)
     
-    # perform search with search engine (writes output files to file system)
-    search_result = uc.search(
-        input_file = mzml_file,
-        engine = 'msgfplus_v2016_09_16'
+    if target_decoy_database is None:
+        target_decoy_database = generate_target_decoy_database(database_file, cache)
+    
+    # initialize Ursgal controller
+    uc = ursgal.UController(
+        params = identification_params
     )
+    uc.params['database'] = target_decoy_database
+    if cpus is not None:
+        uc.params['cpus'] = cpus
+    
+    # perform search with search engine (writes output files to file system)
+    with profiler.stage('search'):
+        search_result = run_stage(
+            cache,
+            'search',
+            [mzml_file, target_decoy_database],
+            dict(identification_params, engine = search_engine),
+            uc.search,
+            input_file = mzml_file,
+            engine = search_engine
+        )
     
     # validate search engine results with percolator (writes output files to file system)
-    validated_result = uc.validate(
-        input_file = search_result,
-        engine     = 'percolator_2_08',
-    )
+    with profiler.stage('validation'):
+        validated_result = run_stage(
+            cache,
+            'validate',
+            [search_result],
+            dict(identification_params, engine = validation_engine),
+            uc.validate,
+            input_file = search_result,
+            engine     = validation_engine,
+        )
     
-    filter_params = {
-        'csv_filter_rules': [
-            ['q-value', 'lte', 0.000000001],
-            ['Is decoy', 'equals', 'false']
-        ]
-    }
-    csv_file_to_filter = '/Users/MS/Desktop/special_projects/SMHacker/msgfplus_v2016_09_16/171027_P8_short_msgfplus_v2016_09_16_pmap_unified_percolator_validated.csv'
     uc = ursgal.UController(
         params = filter_params
     )
 
-    filtered_csv = uc.filter_csv(
-        input_file = csv_file_to_filter,
-    )
+    with profiler.stage('filtering'):
+        filtered_csv = run_stage(
+            cache,
+            'filter',
+            [validated_result],
+            filter_params,
+            uc.filter_csv,
+            input_file = validated_result,
+        )
     
     return filtered_csv
 
 
-def ligandability_quantification(mzml_file, molecule_list, evidence_lookup, formatted_fixed_labels):
-    run = pymzml.run.Reader(mzml_file, extraAccessions = [('MS:1000016', ['value', 'unitName'])])
+def ligandability_quantification(
+        mzml_file,
+        molecule_list,
+        evidence_lookup,
+        formatted_fixed_labels,
+        workers          = None,
+        chunk_size       = None,
+        rt_gating        = False,
+        rt_tolerance     = None,
+        lib              = None,
+        reader           = 'thread',
+        cache_folder     = None,
+        prefilter        = False,
+        checkpoint_file  = None,
+        checkpoint_every = None
+            ):
     
-    params = {
-        'molecules'        : molecule_list,
-        'charges'          : [2, 3, 4],
-        'fixed_labels'     : formatted_fixed_labels,
-        'verbose'          : True,
-        'evidences'        : evidence_lookup
-    }
+    params = get_library_params(molecule_list, evidence_lookup, formatted_fixed_labels)
     
-    pyqms.params['MACHINE_OFFSET_IN_PPM'] = 10.0
-    pyqms.params['REL_MZ_RANGE'] = 1e-05
-    pyqms.params['MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES'] = 2
-    pyqms.params['REQUIRED_PERCENTILE_PEAK_OVERLAP'] = 0.7
-    pyqms.params['M_SCORE_THRESHOLD'] = 0.0
-    pyqms.params['MZ_SCORE_PERCENTILE'] = 0.4
- 
+    mzml_file_basename = os.path.basename(mzml_file)
+    # reader 'thread' or 'process' decodes spectra ahead of matching,
+    # None decodes them in series with matching
+    if reader is None:
+        spectra = matcher.iter_ms1_spectra(mzml_file)
+    else:
+        spectra = matcher.PipelinedSpectrumReader(mzml_file, use_process = reader == 'process')
+    spectra = profiler.counted(spectra, 'spectra')
     
-    lib = pyqms.IsotopologueLibrary(**params)
+    # rt_gating matches every spectrum only against molecules with MS2 evidence
+    # (widened by rt_tolerance) around the spectrum's RT
+    rt_windows = None
+    if rt_gating:
+        rt_windows = matcher.molecule_rt_windows(molecule_list, evidence_lookup, rt_tolerance)
     
-    results = None
-    mzml_file_basename = os.path.basename(mzml_file)
-    i = 0
-    for spectrum in run:
-        if spectrum['ms level'] == 1:
-            i += 1
-            spec_rt, spec_rt_unit = spectrum['MS:1000016']
-            if spec_rt_unit == 'second':
-                spec_time = spec_rt / 60
-            else:
-                spec_time = spec_rt
-            results = lib.match_all(
-                mz_i_list = spectrum.centroidedPeaks,
-                file_name = mzml_file_basename,
-                spec_id   = spectrum['id'],
-                spec_rt   = spec_time,
-                results   = results
+    # prefilter drops all peaks outside the library's m/z coverage before
+    # they are passed to pyqms
+    checkpoint_key = matcher.checkpoint_key(params, quantification_params, rt_windows, prefilter = prefilter)
+    # a prebuilt library (e.g. shared between runs) is used as it is
+    if lib is not None:
+        if prefilter:
+            lib = matcher.PrefilteredLibrary(lib)
+        with profiler.stage('matching'):
+            results = match_spectra(lib, spectra, mzml_file_basename, checkpoint_file, checkpoint_every, checkpoint_key)
+            count_matches(results)
+    # workers > 1 splits the MS1 scans into chunks that are matched in a
+    # process pool, the workers build their libraries within this stage
+    elif workers is not None and workers > 1:
+        with profiler.stage('matching'):
+            results = matcher.match_spectra_parallel(
+                spectra,
+                mzml_file_basename,
+                library_params   = params,
+                pyqms_params     = quantification_params,
+                workers          = workers,
+                chunk_size       = chunk_size,
+                rt_windows       = rt_windows,
+                cache_folder     = cache_folder,
+                prefilter        = prefilter,
+                checkpoint_file  = checkpoint_file,
+                checkpoint_every = checkpoint_every
+            )
+            count_matches(results)
+    else:
+        with profiler.stage('library_build'):
+            lib = matcher.make_library(
+                params,
+                quantification_params,
+                rt_windows,
+                cache_folder = cache_folder,
+                prefilter    = prefilter
             )
-            if i % 200 == 0:
-                print('> Match spectrum', spectrum['id'], end = '\r')
+        with profiler.stage('matching'):
+            results = match_spectra(lib, spectra, mzml_file_basename, checkpoint_file, checkpoint_every, checkpoint_key)
+            count_matches(results)
     return results
 
+
+def match_spectra(lib, spectra, file_name, checkpoint_file = None, checkpoint_every = None, checkpoint_key = None):
+    # with a checkpoint file, matching is resumed after the spectra matched
+    # before an interruption, as long as checkpoint_key did not change
+    if checkpoint_file is None:
+        return matcher.match_spectra(lib, spectra, file_name)
+    return matcher.match_spectra_checkpointed(
+        lib,
+        spectra,
+        file_name,
+        checkpoint_file,
+        checkpoint_every,
+        key = checkpoint_key
+    )
+
+
+def count_matches(results):
+    if results is not None:
+        profiler.count('matches', sum(len(value['data']) for value in results.values()))
+    return
+
+def sweep_quantification(
+        mzml_file,
+        molecule_list,
+        evidence_lookup,
+        formatted_fixed_labels,
+        param_grid,
+        spectra_folder,
+        workers      = None,
+        cache_folder = None
+            ):
+    
+    # the mzML is decoded only once into spectra_folder, every setting of
+    # param_grid (on top of quantification_params) is matched against it
+    spectra = matcher.load_spectra(mzml_file, spectra_folder)
+    
+    return matcher.sweep(
+        spectra,
+        os.path.basename(mzml_file),
+        get_library_params(molecule_list, evidence_lookup, formatted_fixed_labels),
+        param_grid,
+        pyqms_params = quantification_params,
+        cache_folder = cache_folder,
+        workers      = workers
+    )
+
+
 def edit_molecule_list(molecule_list, evidence_lookup, labels):
+    label_names = [label['name'] for label in labels]
+    
     # delete molecules with more than one TEV modification
-    for molecule in molecule_list[:]:
-        num_of_labels = 0
-        for label in labels:
-            num_of_labels += molecule.count(label['name'])
-        if not num_of_labels == 1:
-            molecule_list.remove(molecule)
+    molecule_list[:] = [
+        molecule for molecule in molecule_list
+        if sum(molecule.count(label_name) for label_name in label_names) == 1
+    ]
     print('Initially found {0} peptides via MS2 sequencing. Now I\'ll look for nonsequenced partners.'.format(len(molecule_list)))
     
     # now check for missing partners that were not identified via MS2
+    known_molecules = set(molecule_list)
     for molecule in molecule_list[:]:
-        check_pairs(molecule, molecule_list, evidence_lookup, labels)
+        check_pairs(molecule, molecule_list, evidence_lookup, labels, known_molecules)
     
     print('There are {0} peptides after partner generation.'.format(len(molecule_list)))
     
     return
 
 
-def check_pairs(molecule, molecule_list, evidence_lookup, labels):
+# a ChemicalComposition is not thread-safe, every thread gets its own
+_compositions = threading.local()
+
+# molecules whose formula is kept, a molecule and its partner are looked up
+# right after each other
+HILL_NOTATION_CACHE_SIZE = 2 ** 16
+
+@functools.lru_cache(maxsize = HILL_NOTATION_CACHE_SIZE)
+def hill_notation(molecule):
+    composition = getattr(_compositions, 'composition', None)
+    if composition is None:
+        composition = _compositions.composition = ChemicalComposition()
+    composition.use(molecule)
+    formula = composition.hill_notation_unimod()
+    composition.clear()
+    return formula
+
+
+def check_pairs(molecule, molecule_list, evidence_lookup, labels, known_molecules = None):
+    # known_molecules is a set mirroring molecule_list, kept up to date here
+    if known_molecules is None:
+        known_molecules = set(molecule_list)
+    
+    label_names = tuple(label['name'] for label in labels)
+    current_label_name = split_molecule(molecule, label_names)[1]
+    if current_label_name is None:
+        current_label_name = ''
     partner_label_name = ''
-    current_label_name = ''
-    for label in labels:
-        if molecule.count(label['name']) == 0:
-            partner_label_name = label['name']
-        else:
-            current_label_name = label['name']
+    for label_name in label_names:
+        if label_name != current_label_name:
+            partner_label_name = label_name
     
     # generate partner molecule
     partner_molecule = molecule.replace(current_label_name, partner_label_name)
     
-    if not partner_molecule in molecule_list:
+    if not partner_molecule in known_molecules:
         # new partner molecule should be added to the molecule list
         molecule_list.append(partner_molecule)
+        known_molecules.add(partner_molecule)
         
         # find molecule in evidence lookup
-        c = pyqms.ChemicalComposition()
-        c.use(molecule)
-        if molecule in evidence_lookup[c.hill_notation_unimod()]:
-            trivial_names = evidence_lookup[c.hill_notation_unimod()][molecule]['trivial_names'].copy()
+        formula = hill_notation(molecule)
+        if molecule in evidence_lookup[formula]:
+            trivial_names = evidence_lookup[formula][molecule]['trivial_names'].copy()
             trivial_names.extend({'no MS2': True})
-            evidence = evidence_lookup[c.hill_notation_unimod()][molecule]['evidences'].copy()
+            evidence = evidence_lookup[formula][molecule]['evidences'].copy()
             tmp_dict = {
                 partner_molecule:
                 {
@@ -195,124 +380,135 @@ def check_pairs(molecule, molecule_list, evidence_lookup, labels):
                     'trivial_names': trivial_names
                 }
             }
-            c.clear()
-            c.use(partner_molecule)
-            evidence_lookup[c.hill_notation_unimod()] = tmp_dict
-        c.clear()
+            evidence_lookup[hill_notation(partner_molecule)] = tmp_dict
     return
 
 
-def calculate_ligandability_ratios(results):
+def calculate_ligandability_ratios(
+        results,
+        quant_summary_file,
+        result_csv_file,
+        ratios_folder,
+        plot_file_name = None,
+        label_names    = None,
+        min_pearson    = None,
+        min_overlap    = None
+            ):
     
-    return
+    # min_pearson and/or min_overlap switch on the coelution curation, pairs
+    # failing it are not plotted
+    if label_names is None:
+        label_names = [label['name'] for label in default_labels]
+    
+    with profiler.stage('ratio_loading'):
+        rs = Ratios(quant_summary_file, result_csv_file, results, label_names)
+        rs.read_and_parse_files()
+        profiler.count('keys', len(rs))
+    with profiler.stage('curation'):
+        rs.curate_pairs(min_pearson = min_pearson, min_overlap = min_overlap)
+    with profiler.stage('ratio_saving'):
+        rs.save(ratios_folder)
+    
+    if plot_file_name is not None:
+        plot_ligandability_ratios(rs, plot_file_name, label_names)
+    
+    return rs
 
 
-def main():
-    showStartHello()
+def plot_ligandability_ratios(rs, plot_file_name, label_names = None):
+    # one file per key, sorted by ratio
+    if label_names is None:
+        label_names = [label['name'] for label in default_labels]
     
-    # add new modifications
-    labels = [
-        {
-            'name': 'TEV_H',
-            'mass': '567.30982',
-            'composition': {'C': 21, '13C': 4, 'H': 39, 'N': 7, '15N': 2, 'O': 6}
-        },
-        {
-            'name': 'TEV_L',
-            'mass': '561.30233',
-            'composition': {'C': 25, 'H': 39, 'N': 9, 'O': 6}
-        }
-    ]
+    with profiler.stage('plotting'):
+        gen = rs.calculate_ratios(label_names[0], label_names[1], 'max I in window')
+        plot_files = rs.plot_pairs_batch(
+            [key for key, ratio in sorted(gen)],
+            plot_file_name,
+            {label_name: n for n, label_name in enumerate(label_names)},
+            one_file_per_key = True
+        )
+        profiler.count('plots', len(plot_files))
     
-#     for label in labels:
-#         new_userdefined_unimod_molecule(label['mass'], label['name'], label['composition'])
+    return plot_files
+
+
+def prepare_molecules(evidence_files, labels = None):
+    if labels is None:
+        labels = default_labels
     
-    # MS/MS identification and validation, output is written to file system
-    database_file = '/Users/MS/Desktop/special_projects/SMHacker/coli.fasta'
-    mzml_file = '/Users/MS/Desktop/special_projects/SMHacker/171027_P8_short.mzML'
-    filtered_result = msms_identification(mzml_file, database_file)
+    with profiler.stage('evidence_parsing'):
+        formatted_fixed_labels, evidence_lookup, molecule_list = pyqms.adaptors.parse_evidence(
+            fixed_labels         = None,
+            evidence_files       = evidence_files,
+            evidence_score_field = 'PEP'
+        )
+        profiler.count('molecules', len(molecule_list))
     
-    # MS isotopic ligandability quantification
-    evidence_file = filtered_result
-    out_folder = '/Users/MS/Desktop/special_projects/SMHacker/msgfplus_v2016_09_16'
+    with profiler.stage('partner_generation'):
+        edit_molecule_list(molecule_list, evidence_lookup, labels)
+        profiler.count('molecules', len(molecule_list))
+    
+    return formatted_fixed_labels, evidence_lookup, molecule_list
 
-    formatted_fixed_labels, evidence_lookup, molecule_list = pyqms.adaptors.parse_evidence(
-        fixed_labels         = None,
-        evidence_files       = [ evidence_file ],
-        evidence_score_field = 'PEP'
-    )   
 
-    edit_molecule_list(molecule_list, evidence_lookup, labels)
-    
-    results = ligandability_quantification(mzml_file, molecule_list, evidence_lookup, formatted_fixed_labels)
+def get_library_params(molecule_list, evidence_lookup, formatted_fixed_labels):
+    return {
+        'molecules'        : molecule_list,
+        'charges'          : [2, 3, 4],
+        'fixed_labels'     : formatted_fixed_labels,
+        'verbose'          : True,
+        'evidences'        : evidence_lookup
+    }
+
 
+def quantify_windows(results, quant_summary_file, result_csv_file, rt_border_tolerance = 10):
+    with profiler.stage('rt_info'):
+        results.write_rt_info_file(
+            output_file         = quant_summary_file,
+            list_of_csvdicts    = None,
+            trivial_name_lookup = None,
+            rt_border_tolerance = rt_border_tolerance,
+            update              = True
+        )
+        # narrow the windows down to the climbed chromatographic peaks
+        Climber().refine_rt_info_file(results, quant_summary_file)
+    with profiler.stage('auc'):
+        results.calc_amounts_from_rt_info_file(
+            rt_info_file         = quant_summary_file,
+            rt_border_tolerance  = 0,
+            calc_amount_function = calc_auc
+        )
+        results.write_result_csv(result_csv_file)
     
-    # serialize, not really necessary...
-    results
-    rt_border_tolerance = 10
+    return quant_summary_file, result_csv_file
 
-    quant_summary_file  = '/Users/MS/Desktop/special_projects/SMHacker/quant_summary.csv'
-    results.write_rt_info_file(
-        output_file         = quant_summary_file,
-        list_of_csvdicts    = None,
-        trivial_name_lookup = None,
-        rt_border_tolerance = rt_border_tolerance,
-        update              = True
-    )
-    results.calc_amounts_from_rt_info_file(
-        rt_info_file         = quant_summary_file,
-        rt_border_tolerance  = rt_border_tolerance,
-        calc_amount_function = calc_auc
-    )
+
+def main():
+    showStartHello()
+    profile = profiler.start('ligandum')
     
-    results.write_result_csv('/Users/MS/Desktop/special_projects/SMHacker/ligand_quant_res.csv')
+#     for label in default_labels:
+#         new_userdefined_unimod_molecule(label['mass'], label['name'], label['composition'])
     
-    rs = Ratios(quant_summary_file, '/Users/MS/Desktop/special_projects/SMHacker/ligand_quant_res.csv', results, ['TEV_H', 'TEV_L'])
-    rs.read_and_parse_files()
-    rs.curate_pairs()
+    # identification, matching, quantification, ratios and plotting run as
+    # stages, a rerun resumes after the last finished stage
+    out_folder = '/Users/MS/Desktop/special_projects/SMHacker/msgfplus_v2016_09_16'
+    ligandum_pipeline = pipeline.ligandum_pipeline(
+        '/Users/MS/Desktop/special_projects/SMHacker/171027_P8_short.mzML',
+        '/Users/MS/Desktop/special_projects/SMHacker/coli.fasta',
+        out_folder,
+        cache_folder = '/Users/MS/Desktop/special_projects/SMHacker/ligandum_cache'
+    )
+    ligandum_pipeline.run()
     
-    gen = rs.calculate_ratios('TEV_H', 'TEV_L', 'max I in window')
-    i = 0
-    for key, ratio in sorted(gen):
-        rs.plot_pairs([key], '/Users/MS/Desktop/special_projects/SMHacker/plots/plot_{0}_{1}.pdf'.format(key[0], key[1]), {'TEV_H': 0, 'TEV_L': 1})
-        i += 1
-        if i % 20 == 0:
-            print('> Plot tuples:', i, end = '\r')
+    # timings, counters and peak memory of every stage
+    profile.report()
+    profile.write(os.path.join(out_folder, 'profile.json'))
+    profiler.stop()
     
     return
 
 
-def calc_auc(obj_for_calc_amount):
-    return_dict = None
-    if len(obj_for_calc_amount['i']) != 0:
-        maxI          = max(obj_for_calc_amount['i'])
-        index_of_maxI = obj_for_calc_amount['i'].index(maxI)
-        amount_rt     = obj_for_calc_amount['rt'][index_of_maxI]
-        amount_score  = obj_for_calc_amount['scores'][index_of_maxI]
-
-        sumI = 0
-        for i in obj_for_calc_amount['i']:
-            sumI += i
-        
-#         rt = list()
-#         i = list()
-#         for k, score in enumerate(obj_for_calc_amount['scores']):
-#             if score > 0.5:
-#                 rt.append(obj_for_calc_amount['rt'][k])
-#                 i.append(obj_for_calc_amount['i'][k])  
-#         aucI = np.trapz(x = rt, y = i)
-
-        aucI = np.trapz(x = obj_for_calc_amount['rt'], y = obj_for_calc_amount['i'])
-        
-        return_dict = {
-            'max I in window'         : maxI,
-            'max I in window (rt)'    : amount_rt,
-            'max I in window (score)' : amount_score,
-            'sum I in window'         : sumI,
-            'auc in window'           : aucI
-        }
-    return return_dict
-
-
 if __name__ == '__main__':
     main()
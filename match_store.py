@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Columnar storage of pyQms matches for ligandability ratio handling
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import math
+import numpy as np
+from collections import namedtuple
+
+
+match = namedtuple(
+    'match',
+    [
+        'spec_id',
+        'rt',
+        'score',
+        'scaling_factor',
+        'peaks'
+    ]
+)
+
+# number of pending peak values before they are moved into the array
+PEAK_BUFFER_FLUSH_SIZE = 1000000
+
+
+class PeakBuffer(object):
+    # one float64 array holding the peaks of many matches, row-wise; a match
+    # only keeps the start and stop row of its peaks. None is stored as nan.
+    # All peaks need the same number of values, the first peak sets it.
+
+    def __init__(self, width = None, array = None):
+        self.width = width
+        self.n_rows = 0
+        self._chunks = []
+        self._pending = []
+        if array is not None:
+            self.width = array.shape[1]
+            self.n_rows = array.shape[0]
+            self._chunks.append(array)
+        return
+
+    def append(self, peaks):
+        start = self.n_rows
+        for peak in peaks:
+            if self.width is None:
+                self.width = len(peak)
+            elif len(peak) != self.width:
+                raise ValueError(
+                    'Peak {0} has {1} values, the buffer holds {2} per peak'.format(peak, len(peak), self.width)
+                )
+            self._pending.extend(math.nan if value is None else value for value in peak)
+            self.n_rows += 1
+        if len(self._pending) >= PEAK_BUFFER_FLUSH_SIZE:
+            self._flush()
+        return start, self.n_rows
+
+    def _flush(self):
+        if len(self._pending) > 0:
+            self._chunks.append(np.array(self._pending, dtype = np.float64).reshape(-1, self.width))
+            self._pending = []
+        return
+
+    @property
+    def array(self):
+        self._flush()
+        if len(self._chunks) == 0:
+            return np.zeros((0, 0 if self.width is None else self.width))
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+    def get(self, start, stop):
+        if start == stop:
+            return ()
+        return tuple(
+            tuple(None if math.isnan(value) else value for value in row)
+            for row in self.array[start:stop].tolist()
+        )
+
+
+class MatchStore(object):
+    # matches of one label entry, one NumPy array per field; iterating
+    # yields match namedtuples like the former list of matches
+
+    __slots__ = (
+        'spec_id',
+        'rt',
+        'score',
+        'scaling_factor',
+        'peak_start',
+        'peak_stop',
+        'peak_buffer'
+    )
+
+    def __init__(
+            self,
+            spec_id,
+            rt,
+            score,
+            scaling_factor,
+            peak_start,
+            peak_stop,
+            peak_buffer
+                ):
+
+        self.spec_id = spec_id
+        self.rt = rt
+        self.score = score
+        self.scaling_factor = scaling_factor
+        self.peak_start = peak_start
+        self.peak_stop = peak_stop
+        self.peak_buffer = peak_buffer
+        return
+
+    @classmethod
+    def from_matches(cls, matches, peak_buffer):
+        n = len(matches)
+        rt = np.empty(n)
+        score = np.empty(n)
+        scaling_factor = np.empty(n)
+        peak_start = np.empty(n, dtype = np.int64)
+        peak_stop = np.empty(n, dtype = np.int64)
+        spec_ids = []
+        for i, entry in enumerate(matches):
+            spec_ids.append(entry.spec_id)
+            rt[i] = entry.rt
+            score[i] = math.nan if entry.score is None else entry.score
+            scaling_factor[i] = math.nan if entry.scaling_factor is None else entry.scaling_factor
+            peak_start[i], peak_stop[i] = peak_buffer.append(entry.peaks)
+
+        store = cls(_id_column(spec_ids), rt, score, scaling_factor, peak_start, peak_stop, peak_buffer)
+        # matches are kept sorted by RT, window relies on it
+        if np.any(rt[1:] < rt[:-1]):
+            store = store.select(np.argsort(rt, kind = 'stable'))
+        return store
+
+    def __len__(self):
+        return len(self.rt)
+
+    def __getitem__(self, i):
+        spec_id = self.spec_id[i]
+        if hasattr(spec_id, 'item'):
+            spec_id = spec_id.item()
+        return match(
+            spec_id        = spec_id,
+            rt             = self.rt[i].item(),
+            score          = _none_if_nan(self.score[i].item()),
+            scaling_factor = _none_if_nan(self.scaling_factor[i].item()),
+            peaks          = self.peak_buffer.get(self.peak_start[i], self.peak_stop[i])
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, selection):
+        # selection is a slice, a boolean mask or an index array
+        return MatchStore(
+            self.spec_id[selection],
+            self.rt[selection],
+            self.score[selection],
+            self.scaling_factor[selection],
+            self.peak_start[selection],
+            self.peak_stop[selection],
+            self.peak_buffer
+        )
+
+    def window(self, start, stop):
+        # matches with start <= rt <= stop, as a view
+        first = np.searchsorted(self.rt, start, side = 'left')
+        last = np.searchsorted(self.rt, stop, side = 'right')
+        return self.select(slice(first, max(first, last)))
+
+
+def _none_if_nan(value):
+    if math.isnan(value):
+        return None
+    return value
+
+
+def _id_column(spec_ids):
+    if all(isinstance(spec_id, int) for spec_id in spec_ids):
+        return np.array(spec_ids, dtype = np.int64)
+    column = np.empty(len(spec_ids), dtype = object)
+    for i, spec_id in enumerate(spec_ids):
+        column[i] = spec_id
+    return column
+
+
+def write_match_stores(stores, folder):
+    # all stores are written into one set of .npy files, peaks are compacted
+    # into a single buffer; returns (offset, count, spec_id kind) of every
+    # store. Non integer spec_ids turn the shared column into strings, the
+    # kind lets read_match_stores give integer stores their ids back.
+    os.makedirs(folder, exist_ok = True)
+
+    slices = []
+    offset = 0
+    for store in stores:
+        kind = 'int' if np.issubdtype(store.spec_id.dtype, np.integer) else 'str'
+        slices.append((offset, len(store), kind))
+        offset += len(store)
+
+    columns = {}
+    for name in ['rt', 'score', 'scaling_factor']:
+        columns[name] = np.concatenate([np.zeros(0)] + [getattr(store, name) for store in stores])
+
+    spec_ids = np.concatenate([np.zeros(0, dtype = np.int64)] + [store.spec_id for store in stores])
+    if spec_ids.dtype == object:
+        spec_ids = spec_ids.astype(str)
+    columns['spec_id'] = spec_ids
+
+    peaks = []
+    peak_start = []
+    n_peak_rows = 0
+    width = None
+    for store in stores:
+        lengths = store.peak_stop - store.peak_start
+        starts = n_peak_rows + np.concatenate([np.zeros(1, dtype = np.int64), np.cumsum(lengths)[:-1]])
+        peak_start.append(starts[:len(store)])
+        total = int(lengths.sum())
+        if total > 0:
+            rows = np.repeat(store.peak_start - (starts - n_peak_rows), lengths) + np.arange(total)
+            peaks.append(store.peak_buffer.array[rows])
+            width = store.peak_buffer.width
+        n_peak_rows += total
+    columns['peak_start'] = np.concatenate([np.zeros(0, dtype = np.int64)] + peak_start)
+    columns['peak_stop'] = columns['peak_start'] + np.concatenate(
+        [np.zeros(0, dtype = np.int64)] + [store.peak_stop - store.peak_start for store in stores]
+    )
+    if len(peaks) > 0:
+        columns['peaks'] = np.concatenate(peaks)
+    else:
+        columns['peaks'] = np.zeros((0, 0 if width is None else width))
+
+    for name, column in columns.items():
+        np.save(os.path.join(folder, '{0}.npy'.format(name)), column)
+
+    return slices
+
+
+def read_match_stores(folder, slices, mmap_mode = 'r'):
+    # arrays are memory-mapped, stores are views that are only read on access
+    columns = {}
+    for name in ['spec_id', 'rt', 'score', 'scaling_factor', 'peak_start', 'peak_stop', 'peaks']:
+        columns[name] = np.load(os.path.join(folder, '{0}.npy'.format(name)), mmap_mode = mmap_mode)
+
+    peak_buffer = PeakBuffer(array = columns['peaks'])
+    stores = []
+    for offset, count, *kind in slices:
+        spec_id = columns['spec_id'][offset:offset + count]
+        if kind == ['int'] and not np.issubdtype(spec_id.dtype, np.integer):
+            spec_id = spec_id.astype(np.int64)
+        stores.append(
+            MatchStore(
+                spec_id,
+                columns['rt'][offset:offset + count],
+                columns['score'][offset:offset + count],
+                columns['scaling_factor'][offset:offset + count],
+                columns['peak_start'][offset:offset + count],
+                columns['peak_stop'][offset:offset + count],
+                peak_buffer
+            )
+        )
+    return stores
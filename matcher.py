@@ -0,0 +1,938 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    MS1 matching engine for ligandability quantification
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import copy
+import json
+import collections
+import time
+import itertools
+import pickle
+import hashlib
+import queue
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+import pymzml
+import pyqms
+
+
+default_chunk_size = 500
+
+# spectra between two checkpoints of the matching results
+default_checkpoint_every = 2000
+
+# bounded queue of the pipelined reader, in batches of spectra
+default_queue_size = 50
+default_reader_batch_size = 20
+# seconds a producer blocked on the full queue waits before it checks
+# whether the consumer has stopped
+default_reader_put_timeout = 0.1
+
+# PREFILTER_MIN_INTENSITY: peaks below this intensity are dropped by the
+# prefilter
+# PREFILTER_TOLERANCE_FACTOR: widens the m/z windows of the prefilter relative
+# to pyqms' REL_MZ_RANGE and INTERNAL_PRECISION, so that it never drops a
+# peak pyqms would match
+# CHUNKS_IN_FLIGHT: chunks per worker submitted ahead in parallel matching
+default_params = {
+        'RT_TOLERANCE'              : 1.0,
+        'RT_BLOCK_WIDTH'            : 0.5,
+        'PREFILTER_MIN_INTENSITY'   : 0.0,
+        'PREFILTER_TOLERANCE_FACTOR': 2.0,
+        'CHUNKS_IN_FLIGHT'          : 2
+    }
+
+# library of the current worker process, built once by _init_match_worker
+_worker_library = None
+
+
+def iter_ms1_spectra(mzml_file):
+    run = pymzml.run.Reader(mzml_file, extraAccessions = [('MS:1000016', ['value', 'unitName'])])
+    for spectrum in run:
+        # the ms level is checked first, MS2 peaks are never decoded
+        if spectrum['ms level'] == 1:
+            spec_rt, spec_rt_unit = spectrum['MS:1000016']
+            if spec_rt_unit == 'second':
+                spec_time = spec_rt / 60
+            else:
+                spec_time = spec_rt
+            yield spectrum['id'], spec_time, spectrum.centroidedPeaks
+
+
+class _ReaderError(object):
+
+    def __init__(self, exception):
+        self.exception = exception
+        return
+
+
+def _put_unless_stopped(spectra_queue, item, stop):
+    # False if the consumer stopped before the item could be put
+    while not stop.is_set():
+        try:
+            spectra_queue.put(item, timeout = default_reader_put_timeout)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(spectra_queue):
+    try:
+        while True:
+            spectra_queue.get_nowait()
+    except queue.Empty:
+        pass
+    return
+
+
+def _produce_spectra(mzml_file, spectra_queue, batch_size, stop):
+    spectra = iter_ms1_spectra(mzml_file)
+    try:
+        for batch in iter_chunks(spectra, batch_size):
+            if not _put_unless_stopped(spectra_queue, batch, stop):
+                return
+        last_item = None
+    except Exception as exception:
+        last_item = _ReaderError(exception)
+    finally:
+        # releases the pymzml reader and its open mzML file
+        spectra.close()
+    _put_unless_stopped(spectra_queue, last_item, stop)
+    return
+
+
+class PipelinedSpectrumReader(object):
+    # decodes and centroids MS1 spectra in a background thread (or process)
+    # ahead of the matcher; yields the same tuples as iter_ms1_spectra
+
+    def __init__(
+            self,
+            mzml_file,
+            use_process = False,
+            queue_size  = None,
+            batch_size  = None
+                ):
+
+        if queue_size is None:
+            queue_size = default_queue_size
+        if batch_size is None:
+            batch_size = default_reader_batch_size
+
+        self.mzml_file = mzml_file
+        self.use_process = use_process
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        return
+
+    def __iter__(self):
+        if self.use_process:
+            spectra_queue = multiprocessing.Queue(maxsize = self.queue_size)
+            stop = multiprocessing.Event()
+            producer = multiprocessing.Process(
+                target = _produce_spectra,
+                args   = (self.mzml_file, spectra_queue, self.batch_size, stop),
+                daemon = True
+            )
+        else:
+            spectra_queue = queue.Queue(maxsize = self.queue_size)
+            stop = threading.Event()
+            producer = threading.Thread(
+                target = _produce_spectra,
+                args   = (self.mzml_file, spectra_queue, self.batch_size, stop),
+                daemon = True
+            )
+        producer.start()
+
+        try:
+            while True:
+                batch = spectra_queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, _ReaderError):
+                    raise batch.exception
+                for spectrum in batch:
+                    yield spectrum
+        finally:
+            # also reached if the consumer stops early: the producer gives up
+            # on the full queue, which is drained so that a producer process
+            # can flush its queue and exit
+            stop.set()
+            while producer.is_alive():
+                _drain(spectra_queue)
+                producer.join(timeout = default_reader_put_timeout)
+        return
+
+
+def extract_spectra(mzml_file, spectra_folder, spectra = None):
+    # one-time extraction of all MS1 centroided peaks, ids and RTs into
+    # memory-mappable arrays, read back by SpectraCache
+    if spectra is None:
+        spectra = iter_ms1_spectra(mzml_file)
+    os.makedirs(spectra_folder, exist_ok = True)
+    # an interrupted extraction must not look like a complete one
+    source_file = os.path.join(spectra_folder, 'source.json')
+    if os.path.exists(source_file):
+        os.remove(source_file)
+
+    spec_ids = []
+    rts = []
+    offsets = [0]
+    mz_chunks = []
+    i_chunks = []
+    for spec_id, spec_time, peaks in spectra:
+        peaks = np.asarray(peaks, dtype = np.float64).reshape(-1, 2)
+        spec_ids.append(spec_id)
+        rts.append(spec_time)
+        offsets.append(offsets[-1] + len(peaks))
+        mz_chunks.append(peaks[:, 0])
+        i_chunks.append(peaks[:, 1])
+
+    if all(isinstance(spec_id, int) for spec_id in spec_ids):
+        spec_ids = np.array(spec_ids, dtype = np.int64)
+    else:
+        spec_ids = np.array([str(spec_id) for spec_id in spec_ids])
+
+    columns = {
+        'spec_id': spec_ids,
+        'rt'     : np.array(rts, dtype = np.float64),
+        'offsets': np.array(offsets, dtype = np.int64),
+        'mz'     : np.concatenate([np.zeros(0)] + mz_chunks),
+        'i'      : np.concatenate([np.zeros(0)] + i_chunks)
+    }
+    for name, column in columns.items():
+        np.save(os.path.join(spectra_folder, '{0}.npy'.format(name)), column)
+    source = dict(mzml_source(mzml_file), n_spectra = len(rts))
+    with open(source_file + '.tmp', 'w') as io:
+        json.dump(source, io)
+    os.replace(source_file + '.tmp', source_file)
+
+    return SpectraCache(spectra_folder)
+
+
+def mzml_source(mzml_file):
+    # path, size and modification time identify the extracted mzML file
+    source = {'mzml_file': os.path.abspath(mzml_file), 'size': None, 'mtime_ns': None}
+    if os.path.exists(mzml_file):
+        stat = os.stat(mzml_file)
+        source['size'] = stat.st_size
+        source['mtime_ns'] = stat.st_mtime_ns
+    return source
+
+
+def load_spectra(mzml_file, spectra_folder):
+    # spectra_folder is reused if it holds a complete extraction of the
+    # current mzml_file (source.json is written last and removed before an
+    # extraction starts), otherwise it is re-extracted
+    source_file = os.path.join(spectra_folder, 'source.json')
+    if os.path.exists(source_file):
+        with open(source_file, 'r') as io:
+            source = json.load(io)
+        current_source = mzml_source(mzml_file)
+        if all(source.get(field, None) == value for field, value in current_source.items()):
+            return SpectraCache(spectra_folder)
+        print('> {0} holds spectra of another file or version than {1}, extracting it'.format(spectra_folder, mzml_file))
+    return extract_spectra(mzml_file, spectra_folder)
+
+
+class SpectraCache(object):
+    # memory-mapped MS1 spectra written by extract_spectra; iterating yields
+    # the same (spec_id, rt, peaks) tuples as iter_ms1_spectra
+
+    def __init__(self, spectra_folder, mmap_mode = 'r'):
+        self.spectra_folder = spectra_folder
+        for name in ['spec_id', 'rt', 'offsets', 'mz', 'i']:
+            setattr(self, name, np.load(os.path.join(spectra_folder, '{0}.npy'.format(name)), mmap_mode = mmap_mode))
+        return
+
+    def __len__(self):
+        return len(self.rt)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __getitem__(self, n):
+        start, stop = self.offsets[n], self.offsets[n + 1]
+        peaks = list(zip(self.mz[start:stop].tolist(), self.i[start:stop].tolist()))
+        return self.spec_id[n].item(), self.rt[n].item(), peaks
+
+
+def parameter_grid(grid):
+    # {param: [values]} -> list of settings, lists of settings pass through
+    if isinstance(grid, dict):
+        names = sorted(grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    return list(grid)
+
+
+def sweep(
+        spectra,
+        file_name,
+        library_params,
+        param_grid,
+        pyqms_params = None,
+        cache_folder = None,
+        workers      = None,
+        keep_results = True
+            ):
+
+    # matches the cached spectra once per setting of pyqms params; returns one
+    # (setting, results, summary) per setting, results is None if not kept
+    if pyqms_params is None:
+        pyqms_params = {}
+
+    sweep_results = []
+    for setting in parameter_grid(param_grid):
+        setting_params = dict(pyqms_params, **setting)
+        start_time = time.time()
+        if workers is not None and workers > 1:
+            results = match_spectra_parallel(
+                spectra,
+                file_name,
+                library_params,
+                pyqms_params = setting_params,
+                workers      = workers,
+                cache_folder = cache_folder
+            )
+        else:
+            lib = build_library(library_params, setting_params, cache_folder)
+            results = match_spectra(lib, spectra, file_name, verbose = False)
+
+        n_matches = 0
+        if results is not None:
+            n_matches = sum(len(value['data']) for value in results.values())
+        summary = {
+            'n_keys'   : 0 if results is None else len(results),
+            'n_matches': n_matches,
+            'seconds'  : time.time() - start_time
+        }
+        print('> Sweep {0}: {1} keys, {2} matches in {3:.1f} s'.format(
+            setting, summary['n_keys'], summary['n_matches'], summary['seconds']
+        ))
+        sweep_results.append((setting, results if keep_results else None, summary))
+
+    return sweep_results
+
+
+def iter_chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def library_cache_file(library_params, cache_folder):
+    # keyed by everything the library is built from: molecules, charges,
+    # fixed labels, evidences and the current pyqms params
+    description = {
+        'library_params': {key: value for key, value in library_params.items() if key != 'verbose'},
+        'pyqms_params'  : pyqms.params,
+        'pyqms_version' : getattr(pyqms, '__version__', None)
+    }
+    key = hashlib.sha256(
+        json.dumps(description, sort_keys = True, default = str).encode('utf-8')
+    ).hexdigest()
+    return os.path.join(cache_folder, 'isotopologue_library_{0}.pkl'.format(key))
+
+
+def build_library(library_params, pyqms_params = None, cache_folder = None):
+    if pyqms_params is not None:
+        pyqms.params.update(pyqms_params)
+    if cache_folder is None:
+        return pyqms.IsotopologueLibrary(**library_params)
+
+    cache_file = library_cache_file(library_params, cache_folder)
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as io:
+            return pickle.load(io)
+
+    lib = pyqms.IsotopologueLibrary(**library_params)
+    os.makedirs(cache_folder, exist_ok = True)
+    # written under a temporary name first, so that parallel builds never
+    # read a half written library
+    tmp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'wb') as io:
+        pickle.dump(lib, io, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+    return lib
+
+
+def precompute_library(library_params, pyqms_params = None, cache_folder = None):
+    # makes sure the library is in the cache, without loading it
+    if pyqms_params is not None:
+        pyqms.params.update(pyqms_params)
+    if not os.path.exists(library_cache_file(library_params, cache_folder)):
+        build_library(library_params, cache_folder = cache_folder)
+    return
+
+
+def make_library(
+        library_params,
+        pyqms_params = None,
+        rt_windows   = None,
+        block_width  = None,
+        cache_folder = None,
+        prefilter    = False
+            ):
+
+    if rt_windows is not None:
+        return RTGatedLibrary(library_params, rt_windows, block_width, pyqms_params, cache_folder, prefilter)
+    lib = build_library(library_params, pyqms_params, cache_folder)
+    if prefilter:
+        lib = PrefilteredLibrary(lib)
+    return lib
+
+
+class PeakPrefilter(object):
+    # sorted, merged m/z intervals around every isotopologue peak of a
+    # library; filter() keeps only the peaks inside one of them
+
+    def __init__(self, lib, min_intensity = None, tolerance_factor = None):
+        if min_intensity is None:
+            min_intensity = default_params['PREFILTER_MIN_INTENSITY']
+        if tolerance_factor is None:
+            tolerance_factor = default_params['PREFILTER_TOLERANCE_FACTOR']
+        self.min_intensity = min_intensity
+
+        # pyqms matches mz +- REL_MZ_RANGE * mz, rounded to INTERNAL_PRECISION;
+        # the library mz already include MACHINE_OFFSET_IN_PPM
+        params = getattr(lib, 'params', pyqms.params)
+        rel_tolerance = tolerance_factor * params['REL_MZ_RANGE']
+        abs_tolerance = tolerance_factor / params['INTERNAL_PRECISION']
+
+        # besides the charges, every env entry holds isotope information
+        # ('isot', 'mass', 'abun', ...), so only the charge keys are read
+        mz_values = []
+        for formula, entry in lib.items():
+            for label_percentiles, env in entry['env'].items():
+                for charge in lib.charges:
+                    mz_values.extend(env[charge]['mz'])
+        mz_values = np.sort(np.asarray(mz_values, dtype = np.float64))
+
+        lower = mz_values * (1 - rel_tolerance) - abs_tolerance
+        upper = mz_values * (1 + rel_tolerance) + abs_tolerance
+        # an interval starts where it does not overlap any previous one
+        if len(mz_values) > 0:
+            reach = np.maximum.accumulate(upper)
+            starts = np.concatenate([[True], lower[1:] > reach[:-1]])
+            stops = np.concatenate([starts[1:], [True]])
+            self.lower = lower[starts]
+            self.upper = reach[stops]
+        else:
+            self.lower = np.zeros(0)
+            self.upper = np.zeros(0)
+        return
+
+    def __len__(self):
+        return len(self.lower)
+
+    def filter(self, peaks):
+        peaks = np.asarray(peaks, dtype = np.float64).reshape(-1, 2)
+        mz = peaks[:, 0]
+        i = peaks[:, 1]
+        interval = np.searchsorted(self.lower, mz, side = 'right') - 1
+        keep = (
+            (interval >= 0) &
+            (mz <= self.upper[np.maximum(interval, 0)]) &
+            (i >= self.min_intensity)
+        )
+        return list(zip(mz[keep].tolist(), i[keep].tolist()))
+
+
+class PrefilteredLibrary(object):
+    # passes only the peaks within the library's m/z coverage to match_all
+
+    def __init__(self, lib, min_intensity = None):
+        self.lib = lib
+        self.prefilter = PeakPrefilter(lib, min_intensity = min_intensity)
+        return
+
+    @property
+    def lookup(self):
+        return self.lib.lookup
+
+    def match_all(
+            self,
+            mz_i_list,
+            file_name,
+            spec_id,
+            spec_rt,
+            results = None
+                ):
+
+        mz_i_list = self.prefilter.filter(mz_i_list)
+        if len(mz_i_list) == 0:
+            return results
+        return self.lib.match_all(
+            mz_i_list = mz_i_list,
+            file_name = file_name,
+            spec_id   = spec_id,
+            spec_rt   = spec_rt,
+            results   = results
+        )
+
+
+def molecule_rt_windows(molecule_list, evidence_lookup, rt_tolerance = None):
+    # (start, stop) window per molecule from its MS2 evidence RTs, widened by
+    # rt_tolerance; molecules without evidence RT get None and are always matched
+    if rt_tolerance is None:
+        rt_tolerance = default_params['RT_TOLERANCE']
+
+    evidence_rts = {}
+    for formula, molecules in evidence_lookup.items():
+        for molecule, entry in molecules.items():
+            rts = [evidence['RT'] for evidence in entry['evidences'] if evidence.get('RT') is not None]
+            if len(rts) > 0:
+                evidence_rts[molecule] = rts
+
+    rt_windows = {}
+    for molecule in molecule_list:
+        rts = evidence_rts.get(molecule, None)
+        if rts is None:
+            rt_windows[molecule] = None
+        else:
+            rt_windows[molecule] = (min(rts) - rt_tolerance, max(rts) + rt_tolerance)
+    return rt_windows
+
+
+def merge_lookup(target, source):
+    # recursive union of two pyqms lookups: dicts are merged key by key, lists
+    # (e.g. the molecules of an isobaric formula) and sets gain the missing
+    # entries; new entries are copied, so that source is never modified
+    for name, entries in source.items():
+        if name not in target:
+            target[name] = copy.deepcopy(entries)
+        elif isinstance(entries, dict) and isinstance(target[name], dict):
+            merge_lookup(target[name], entries)
+        elif isinstance(entries, list) and isinstance(target[name], list):
+            for entry in entries:
+                if entry not in target[name]:
+                    target[name].append(copy.deepcopy(entry))
+        elif isinstance(entries, set) and isinstance(target[name], set):
+            target[name] |= entries
+    return target
+
+
+class _MoleculeSweep(object):
+    # molecules active in a block, updated incrementally while the blocks are
+    # visited in ascending order; a lower block restarts the sweep
+
+    def __init__(self, molecule_blocks, always_active):
+        self.always_active = always_active
+        self.starts = sorted((first_block, n) for n, first_block, last_block in molecule_blocks)
+        self.stops = sorted((last_block, n) for n, first_block, last_block in molecule_blocks)
+        self.reset()
+        return
+
+    def reset(self):
+        self.block = None
+        self.next_start = 0
+        self.next_stop = 0
+        self.active = set(self.always_active)
+        return
+
+    def molecules_at(self, block):
+        # sorted indices of the molecules whose window overlaps block
+        if self.block is not None and block < self.block:
+            self.reset()
+        while self.next_start < len(self.starts) and self.starts[self.next_start][0] <= block:
+            self.active.add(self.starts[self.next_start][1])
+            self.next_start += 1
+        while self.next_stop < len(self.stops) and self.stops[self.next_stop][0] < block:
+            self.active.discard(self.stops[self.next_stop][1])
+            self.next_stop += 1
+        self.block = block
+        return tuple(sorted(self.active))
+
+
+def library_formulas(lib, molecules):
+    # formulas of the molecules in lib, including their fixed label variations
+    variations = lib.lookup['molecule fixed label variations']
+    molecule_to_formula = lib.lookup['molecule to formula']
+    formulas = set()
+    for molecule in molecules:
+        for variation in variations.get(molecule, [molecule]):
+            formula = molecule_to_formula.get(variation, None)
+            if formula is not None:
+                formulas.add(formula)
+    return formulas
+
+
+def slice_library(lib, formulas):
+    # library matching only formulas, sharing isotope envelopes, params and
+    # lookup with lib; match sets are packed like pyqms packs them
+    sliced = pyqms.IsotopologueLibrary.__new__(pyqms.IsotopologueLibrary)
+    sliced.__dict__.update(lib.__dict__)
+    for formula in formulas:
+        if formula in lib:
+            dict.__setitem__(sliced, formula, lib[formula])
+
+    sliced.formulas_sorted_by_mz = [entry for entry in lib.formulas_sorted_by_mz if entry[4] in formulas]
+    sliced.match_sets = {}
+    sliced.match_set_mz_range = [None, None]
+    n_formulas = len(sliced.formulas_sorted_by_mz)
+    bin_size = lib.params['MAX_MOLECULES_PER_MATCH_BIN']
+    for package_number, first in enumerate(range(0, n_formulas, bin_size)):
+        ids = [first, min(first + bin_size, n_formulas)]
+        entries = sliced.formulas_sorted_by_mz[ids[0]:ids[1]]
+        tmzs = set()
+        for lower_mz, upper_mz, charge, label_percentiles, formula in entries:
+            tmzs |= lib[formula]['env'][label_percentiles][charge]['atmzs']
+        sliced.match_sets[package_number] = {
+            'ids'     : ids,
+            'tmzs'    : tmzs,
+            'mz_range': [min(entry[0] for entry in entries), max(entry[1] for entry in entries)]
+        }
+    if n_formulas > 0:
+        sliced.match_set_mz_range = [
+            min(match_set['mz_range'][0] for match_set in sliced.match_sets.values()),
+            max(match_set['mz_range'][1] for match_set in sliced.match_sets.values())
+        ]
+    return sliced
+
+
+class RTGatedLibrary(object):
+
+    def __init__(
+            self,
+            library_params,
+            rt_windows,
+            block_width  = None,
+            pyqms_params = None,
+            cache_folder = None,
+            prefilter    = False
+                ):
+
+        if block_width is None:
+            block_width = default_params['RT_BLOCK_WIDTH']
+
+        self.library_params = library_params
+        self.block_width = block_width
+        self.prefilter = prefilter
+
+        # isotope envelopes are built once for all molecules, every block
+        # matches a slice of this library
+        self.lib = build_library(library_params, pyqms_params, cache_folder)
+        self.lookup = self.lib.lookup
+
+        self._always_active = []
+        self._molecule_blocks = []
+
+        # the RT axis is cut into blocks, every block holds the molecules whose
+        # window overlaps it; consecutive blocks with the same molecules share
+        # one slice
+        for n, molecule in enumerate(library_params['molecules']):
+            window = rt_windows.get(molecule, None)
+            if window is None:
+                self._always_active.append(n)
+            else:
+                self._molecule_blocks.append((n, int(window[0] // block_width), int(window[1] // block_width)))
+        self._sweep = _MoleculeSweep(self._molecule_blocks, self._always_active)
+
+        # spectra arrive in RT order, so only the slice of the current block
+        # is kept
+        self._block = None
+        self._block_molecules = None
+        self._library = None
+        return
+
+    def molecules_for_block(self, block):
+        molecules = self.library_params['molecules']
+        return tuple(molecules[n] for n in self._sweep.molecules_at(block))
+
+    def library_for_rt(self, spec_rt):
+        block = int(spec_rt // self.block_width)
+        if block == self._block:
+            return self._library
+        self._block = block
+
+        molecules = self.molecules_for_block(block)
+        if molecules == self._block_molecules:
+            return self._library
+        # the slice of the passed block is dropped before the next is made
+        self._block_molecules = molecules
+        self._library = None
+
+        lib = slice_library(self.lib, library_formulas(self.lib, molecules))
+        if len(lib.formulas_sorted_by_mz) == 0:
+            return None
+        if self.prefilter:
+            lib = PrefilteredLibrary(lib)
+        self._library = lib
+        return lib
+
+    def match_all(
+            self,
+            mz_i_list,
+            file_name,
+            spec_id,
+            spec_rt,
+            results = None
+                ):
+
+        lib = self.library_for_rt(spec_rt)
+        if lib is None:
+            return results
+        return lib.match_all(
+            mz_i_list = mz_i_list,
+            file_name = file_name,
+            spec_id   = spec_id,
+            spec_rt   = spec_rt,
+            results   = results
+        )
+
+
+def match_spectra(lib, spectra, file_name, results = None, verbose = True):
+    for i, (spec_id, spec_time, peaks) in enumerate(spectra, 1):
+        results = lib.match_all(
+            mz_i_list = peaks,
+            file_name = file_name,
+            spec_id   = spec_id,
+            spec_rt   = spec_time,
+            results   = results
+        )
+        if verbose and i % 200 == 0:
+            print('> Match spectrum', spec_id, end = '\r')
+    return results
+
+
+def checkpoint_key(library_params, pyqms_params = None, rt_windows = None, block_width = None, prefilter = False):
+    # hash of everything the matching results depend on besides the spectra,
+    # a checkpoint written with other settings is not resumed
+    description = {
+        'library_params': {key: value for key, value in library_params.items() if key != 'verbose'},
+        'pyqms_params'  : dict(pyqms.params, **(pyqms_params or {})),
+        'rt_windows'    : None if rt_windows is None else sorted(rt_windows.items()),
+        'block_width'   : block_width,
+        'prefilter'     : prefilter
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys = True, default = str).encode('utf-8')
+    ).hexdigest()
+
+
+def read_checkpoint(checkpoint_file, file_name, key = None):
+    # results and number of spectra matched so far, (None, 0) without a
+    # checkpoint of this file and key
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return None, 0
+    with open(checkpoint_file, 'rb') as io:
+        checkpoint = pickle.load(io)
+    if checkpoint['file_name'] != file_name:
+        return None, 0
+    if checkpoint.get('key', None) != key:
+        print('> Ignoring checkpoint written with other matching settings')
+        return None, 0
+    print('> Resuming matching after {0} spectra'.format(checkpoint['n_spectra']))
+    return checkpoint['results'], checkpoint['n_spectra']
+
+
+def write_checkpoint(checkpoint_file, file_name, results, n_spectra, key = None):
+    # replaces the previous checkpoint only once the new one is complete
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_file)), exist_ok = True)
+    tmp_file = '{0}.tmp'.format(checkpoint_file)
+    with open(tmp_file, 'wb') as io:
+        pickle.dump(
+            {'file_name': file_name, 'key': key, 'results': results, 'n_spectra': n_spectra},
+            io,
+            protocol = pickle.HIGHEST_PROTOCOL
+        )
+    os.replace(tmp_file, checkpoint_file)
+    return
+
+
+def match_spectra_checkpointed(
+        lib,
+        spectra,
+        file_name,
+        checkpoint_file,
+        checkpoint_every = None,
+        verbose          = True,
+        key              = None
+            ):
+
+    # like match_spectra, writing the results every checkpoint_every spectra;
+    # a rerun with the same key skips the spectra that are in the checkpoint
+    # already
+    if checkpoint_every is None:
+        checkpoint_every = default_checkpoint_every
+
+    results, n_spectra = read_checkpoint(checkpoint_file, file_name, key)
+    for spec_id, spec_time, peaks in itertools.islice(spectra, n_spectra, None):
+        results = lib.match_all(
+            mz_i_list = peaks,
+            file_name = file_name,
+            spec_id   = spec_id,
+            spec_rt   = spec_time,
+            results   = results
+        )
+        n_spectra += 1
+        if n_spectra % checkpoint_every == 0:
+            write_checkpoint(checkpoint_file, file_name, results, n_spectra, key)
+        if verbose and n_spectra % 200 == 0:
+            print('> Match spectrum', spec_id, end = '\r')
+    return results
+
+
+def merge_results(partial_results):
+    # partial results have to be passed in scan order, so that keys and
+    # matches end up in the same order as in a serial run
+    merged = None
+    for results in partial_results:
+        if results is None:
+            continue
+        if merged is None:
+            merged = results
+            continue
+        merge_lookup(merged.lookup, results.lookup)
+        add_matches(merged, ((key, value['data']) for key, value in results.items()))
+    return merged
+
+
+def empty_results(lib):
+    # pyqms results as lib.match_all creates them, for prefiltered and RT
+    # gated libraries the ones of the wrapped library
+    while not isinstance(lib, pyqms.IsotopologueLibrary):
+        lib = lib.lib
+    return pyqms.Results(
+        aa_compositions        = lib.aa_compositions,
+        charges                = lib.charges,
+        fixed_labels           = lib.fixed_labels,
+        isotopic_distributions = lib.isotopic_distributions,
+        lookup                 = lib.lookup,
+        metabolic_labels       = lib.metabolic_labels,
+        params                 = lib.params
+    )
+
+
+def add_matches(results, matches):
+    # matches: (key, data) pairs in scan order, added through pyqms, which
+    # keeps len_data, max_score, max_score_index and the index up to date
+    for key, data in matches:
+        for entry in data:
+            results.add(key, entry)
+    return results
+
+
+def _init_match_worker(library_params, pyqms_params, rt_windows, block_width, cache_folder, prefilter):
+    global _worker_library
+    _worker_library = make_library(library_params, pyqms_params, rt_windows, block_width, cache_folder, prefilter)
+    return
+
+
+def _empty_results():
+    return empty_results(_worker_library)
+
+
+def _match_chunk(args):
+    # only the matches are sent back, the library lookup and the other
+    # results attributes are the same for every chunk
+    spectra, file_name = args
+    results = match_spectra(_worker_library, spectra, file_name, verbose = False)
+    if results is None:
+        return []
+    return [
+        (tuple(key), [tuple(entry) for entry in value['data']])
+        for key, value in results.items()
+    ]
+
+
+def match_spectra_parallel(
+        spectra,
+        file_name,
+        library_params,
+        pyqms_params     = None,
+        workers          = None,
+        chunk_size       = None,
+        rt_windows       = None,
+        block_width      = None,
+        cache_folder     = None,
+        prefilter        = False,
+        checkpoint_file  = None,
+        checkpoint_every = None
+            ):
+
+    if workers is None:
+        workers = os.cpu_count()
+    if chunk_size is None:
+        chunk_size = default_chunk_size
+    if checkpoint_every is None:
+        checkpoint_every = default_checkpoint_every
+
+    # with a checkpoint file, the merged results are written at least every
+    # checkpoint_every spectra and a rerun with the same settings continues
+    # after them
+    key = checkpoint_key(library_params, pyqms_params, rt_windows, block_width, prefilter)
+    results, n_spectra = read_checkpoint(checkpoint_file, file_name, key)
+    if n_spectra > 0:
+        spectra = itertools.islice(spectra, n_spectra, None)
+
+    # RT gated workers load the library from a cache folder, a temporary one
+    # if none is given
+    tmp_cache_folder = None
+    if rt_windows is not None and cache_folder is None:
+        tmp_cache_folder = tempfile.mkdtemp(prefix = 'ligandum_libraries_')
+        cache_folder = tmp_cache_folder
+
+    last_checkpoint = n_spectra
+    try:
+        # with a cache folder the library is built once here and loaded by the workers
+        if cache_folder is not None:
+            precompute_library(library_params, pyqms_params, cache_folder)
+
+        with multiprocessing.Pool(
+                processes   = workers,
+                initializer = _init_match_worker,
+                initargs    = (library_params, pyqms_params, rt_windows, block_width, cache_folder, prefilter)
+                    ) as pool:
+            # at most CHUNKS_IN_FLIGHT chunks per worker are submitted ahead and
+            # consumed in order, so that the spectra are only read as fast as they
+            # are matched and the reader's bounded queue keeps limiting memory
+            pending = collections.deque()
+            chunks = iter_chunks(spectra, chunk_size)
+            n = 0
+            while True:
+                while len(pending) < workers * default_params['CHUNKS_IN_FLIGHT']:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append((len(chunk), pool.apply_async(_match_chunk, ((chunk, file_name),))))
+                if len(pending) == 0:
+                    break
+                chunk_length, chunk_matches = pending.popleft()
+                matches = chunk_matches.get()
+                if len(matches) > 0:
+                    if results is None:
+                        results = pool.apply(_empty_results)
+                    add_matches(results, matches)
+                n_spectra += chunk_length
+                if checkpoint_file is not None and n_spectra - last_checkpoint >= checkpoint_every:
+                    write_checkpoint(checkpoint_file, file_name, results, n_spectra, key)
+                    last_checkpoint = n_spectra
+                n += 1
+                print('> Matched chunk', n, end = '\r')
+    finally:
+        if tmp_cache_folder is not None:
+            shutil.rmtree(tmp_cache_folder, ignore_errors = True)
+
+    return results
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Resumable stage graph running a complete ligandability analysis
+
+    Every finished stage leaves a marker with its outputs in the stages
+    folder of the output folder. A rerun skips finished stages and continues
+    with the first unfinished one; stages downstream of a rerun stage are
+    rerun as well. MS1 matching additionally checkpoints its results every
+    CHECKPOINT_EVERY spectra; a checkpoint written for other molecules or
+    matching settings is not resumed.
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import json
+import time
+import pickle
+import ligandum
+import storage
+import profiler
+from ratios import Ratios
+
+
+STAGES_FOLDER = 'stages'
+
+default_params = {
+        'CHECKPOINT_EVERY': 2000
+    }
+
+
+class Stage(object):
+
+    def __init__(self, name, function, requires = None, params = None):
+        # function(pipeline, inputs) returns the json serializable outputs of
+        # the stage, inputs holds the outputs of the required stages; a change
+        # of the pipeline config entries named in params reruns the stage
+        self.name = name
+        self.function = function
+        self.requires = [] if requires is None else requires
+        self.params = [] if params is None else params
+        return
+
+
+class Pipeline(object):
+
+    def __init__(self, out_folder, stages, config = None):
+        self.out_folder = out_folder
+        self.stages = stages
+        self.config = {} if config is None else config
+        self.stages_folder = os.path.join(out_folder, STAGES_FOLDER)
+        return
+
+    def path(self, *names):
+        return os.path.join(self.out_folder, *names)
+
+    def marker_file(self, name):
+        return os.path.join(self.stages_folder, '{0}.json'.format(name))
+
+    def stage_params(self, stage):
+        return json.loads(json.dumps(
+            {param: self.config.get(param, None) for param in stage.params},
+            default = str
+        ))
+
+    def read_marker(self, stage):
+        # None if the stage did not finish with the current params
+        marker_file = self.marker_file(stage.name)
+        if not os.path.exists(marker_file):
+            return None
+        with open(marker_file, 'r') as io:
+            marker = json.load(io)
+        if marker['params'] != self.stage_params(stage):
+            return None
+        return marker
+
+    def write_marker(self, stage, outputs, seconds):
+        # written last and atomically, it marks the stage as complete
+        os.makedirs(self.stages_folder, exist_ok = True)
+        marker_file = self.marker_file(stage.name)
+        tmp_file = '{0}.tmp'.format(marker_file)
+        with open(tmp_file, 'w') as io:
+            json.dump(
+                {
+                    'stage'   : stage.name,
+                    'outputs' : outputs,
+                    'params'  : self.stage_params(stage),
+                    'finished': time.time(),
+                    'seconds' : seconds
+                },
+                io,
+                indent  = 2,
+                default = str
+            )
+        os.replace(tmp_file, marker_file)
+        return
+
+    def remove_marker(self, name):
+        if os.path.exists(self.marker_file(name)):
+            os.remove(self.marker_file(name))
+        return
+
+    def run(self, force = None):
+        # force: names of stages to rerun even if they are finished
+        force = set() if force is None else set(force)
+        outputs = {}
+        rerun = set()
+        for stage in self.stages:
+            marker = self.read_marker(stage)
+            upstream_rerun = any(required in rerun for required in stage.requires)
+            if marker is not None and not upstream_rerun and stage.name not in force:
+                print('> Stage {0} finished before, skipping it'.format(stage.name))
+                outputs[stage.name] = marker['outputs']
+                continue
+
+            self.remove_marker(stage.name)
+            print('> Running stage {0}'.format(stage.name))
+            start_time = time.time()
+            with profiler.stage(stage.name):
+                outputs[stage.name] = stage.function(
+                    self,
+                    {required: outputs[required] for required in stage.requires}
+                )
+            self.write_marker(stage, outputs[stage.name], time.time() - start_time)
+            rerun.add(stage.name)
+
+        return outputs
+
+
+def identification_stage(pipeline, inputs):
+    evidence_file = ligandum.msms_identification(
+        pipeline.config['mzml_file'],
+        pipeline.config['database_file'],
+        cache_folder = pipeline.config['cache_folder']
+    )
+    return {'evidence_file': evidence_file}
+
+
+def molecules_stage(pipeline, inputs):
+    molecules_file = pipeline.path('molecules.pkl')
+    molecules = ligandum.prepare_molecules([inputs['identification']['evidence_file']])
+    with open(molecules_file, 'wb') as io:
+        pickle.dump(molecules, io, protocol = pickle.HIGHEST_PROTOCOL)
+    return {'molecules_file': molecules_file}
+
+
+def matching_stage(pipeline, inputs):
+    with open(inputs['molecules']['molecules_file'], 'rb') as io:
+        formatted_fixed_labels, evidence_lookup, molecule_list = pickle.load(io)
+
+    checkpoint_file = pipeline.path('matching_checkpoint.pkl')
+    results = ligandum.ligandability_quantification(
+        pipeline.config['mzml_file'],
+        molecule_list,
+        evidence_lookup,
+        formatted_fixed_labels,
+        workers          = pipeline.config.get('workers', None),
+        cache_folder     = os.path.join(pipeline.config['cache_folder'], 'libraries'),
+        checkpoint_file  = checkpoint_file,
+        checkpoint_every = pipeline.config.get('checkpoint_every', default_params['CHECKPOINT_EVERY'])
+    )
+
+    # the complete pyqms results for quantification and memory-mappable
+    # arrays for fast reloading
+    results_file = pipeline.path('pyQms_results.pkl')
+    with open(results_file, 'wb') as io:
+        pickle.dump(results, io, protocol = pickle.HIGHEST_PROTOCOL)
+    results_folder = pipeline.path('pyQms_results')
+    storage.save_results(results, results_folder)
+
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return {'results_file': results_file, 'results_folder': results_folder}
+
+
+def quantification_stage(pipeline, inputs):
+    with open(inputs['matching']['results_file'], 'rb') as io:
+        results = pickle.load(io)
+    quant_summary_file, result_csv_file = ligandum.quantify_windows(
+        results,
+        pipeline.path('quant_summary.csv'),
+        pipeline.path('ligand_quant_res.csv')
+    )
+    return {'quant_summary_file': quant_summary_file, 'result_csv_file': result_csv_file}
+
+
+def ratios_stage(pipeline, inputs):
+    ratios_folder = pipeline.path('ratios')
+    ligandum.calculate_ligandability_ratios(
+        storage.load_results(inputs['matching']['results_folder']),
+        inputs['quantification']['quant_summary_file'],
+        inputs['quantification']['result_csv_file'],
+        ratios_folder
+    )
+    return {'ratios_folder': ratios_folder}
+
+
+def plotting_stage(pipeline, inputs):
+    plot_folder = pipeline.path('plots')
+    os.makedirs(plot_folder, exist_ok = True)
+    plot_files = ligandum.plot_ligandability_ratios(
+        Ratios.load(inputs['ratios']['ratios_folder']),
+        os.path.join(plot_folder, 'plot_{0}_{1}.pdf')
+    )
+    return {'plot_files': plot_files}
+
+
+def ligandum_pipeline(
+        mzml_file,
+        database_file,
+        out_folder,
+        cache_folder     = None,
+        workers          = None,
+        checkpoint_every = None
+            ):
+
+    if cache_folder is None:
+        cache_folder = os.path.join(out_folder, 'ligandum_cache')
+    if checkpoint_every is None:
+        checkpoint_every = default_params['CHECKPOINT_EVERY']
+
+    stages = [
+        Stage('identification', identification_stage, params = ['mzml_file', 'database_file']),
+        Stage('molecules', molecules_stage, ['identification']),
+        Stage('matching', matching_stage, ['molecules'], params = ['mzml_file']),
+        Stage('quantification', quantification_stage, ['matching']),
+        Stage('ratios', ratios_stage, ['matching', 'quantification']),
+        Stage('plotting', plotting_stage, ['ratios'])
+    ]
+    config = {
+        'mzml_file'       : mzml_file,
+        'database_file'   : database_file,
+        'cache_folder'    : cache_folder,
+        'workers'         : workers,
+        'checkpoint_every': checkpoint_every
+    }
+    os.makedirs(out_folder, exist_ok = True)
+    return Pipeline(out_folder, stages, config)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Plotting backends for ligandability ratio plots
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import importlib.util
+
+
+# R's default palette, label_colors index into it for both backends
+R_PALETTE = [
+    'black',
+    '#DF536B',
+    '#61D04F',
+    '#2297E6',
+    '#28E2E5',
+    '#CD0BBC',
+    '#F5C710',
+    '#9E9E9E'
+]
+
+
+def get_backend(backend = None):
+    # backend is an instance, a name ('matplotlib' or 'r') or None for the
+    # default, which is matplotlib and R if matplotlib is not installed
+    if backend is None:
+        if importlib.util.find_spec('matplotlib') is not None:
+            backend = 'matplotlib'
+        else:
+            backend = 'r'
+    if backend == 'matplotlib':
+        return MatplotlibPlotBackend()
+    if backend == 'r':
+        return RPlotBackend()
+    return backend
+
+
+class MatplotlibPlotBackend(object):
+    # figures are drawn without pyplot, so the backend of the process
+    # (e.g. an interactive one of the caller) is left alone
+
+    name = 'matplotlib'
+
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.backends.backend_pdf import PdfPages
+        self._figure_class = Figure
+        self._canvas_class = FigureCanvasAgg
+        self._pdf_pages_class = PdfPages
+        self._pdf = None
+        self._file_name = None
+        self._onefile = True
+        self._page = 0
+        return
+
+    def open(self, file_name, onefile = True):
+        # with onefile = False, file_name holds a %d placeholder for the page
+        self._file_name = file_name
+        self._onefile = onefile
+        self._page = 0
+        if onefile:
+            self._pdf = self._pdf_pages_class(file_name)
+        return
+
+    def draw(self, plot_data, label_colors, color_table):
+        figure = self._figure_class(figsize = (7, 7))
+        self._canvas_class(figure)
+        axes = figure.subplots()
+
+        axes.set_title(plot_data['title'], fontsize = 9)
+        axes.set_xlabel('Retention Time [min]')
+        axes.set_ylabel('Abundance [a.u.]')
+        axes.set_xlim(*plot_data['xlim'])
+        axes.set_ylim(*plot_data['ylim'])
+        axes.spines['top'].set_visible(False)
+        axes.spines['right'].set_visible(False)
+
+        for key, value in plot_data['curves'].items():
+            axes.plot(
+                value['x'],
+                value['y'],
+                linewidth = 0.7,
+                color     = R_PALETTE[label_colors[key] % len(R_PALETTE)]
+            )
+            axes.scatter(
+                value['x'],
+                value['y'],
+                c          = [_rgb(color_table[i][0]) for i in value['ci']],
+                s          = 12,
+                linewidths = 0.1,
+                zorder     = 3
+            )
+
+        for key, evidences in plot_data['ms2_evidences'].items():
+            if len(evidences) > 0:
+                axes.scatter(
+                    [float(evidence) for evidence in evidences],
+                    [0] * len(evidences),
+                    marker     = '^',
+                    facecolors = 'none',
+                    edgecolors = R_PALETTE[label_colors[key] % len(R_PALETTE)],
+                    linewidths = 0.7,
+                    zorder     = 3
+                )
+
+        self._insert_mscore_legend(axes, color_table)
+
+        if self._onefile:
+            self._pdf.savefig(figure)
+        else:
+            self._page += 1
+            figure.savefig(self._file_name % self._page)
+        return
+
+    def _insert_mscore_legend(self, axes, color_table):
+        import matplotlib.patches
+        handles = [
+            matplotlib.patches.Patch(
+                facecolor = _rgb(color_table[i][0]),
+                label     = '{0:2.1f}'.format(i / 100.)
+            )
+            for i in range(0, 101, 10)
+        ]
+        axes.legend(
+            handles  = handles,
+            title    = 'mScore',
+            loc      = 'upper right',
+            frameon  = False,
+            fontsize = 7
+        )
+        return
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        return
+
+
+class RPlotBackend(object):
+
+    name = 'r'
+
+    def __init__(self, graphics = None, grdevices = None):
+        assert self._import_rpy2() is True, 'require R & rpy2 installed...'
+        if graphics is None:
+            graphics = importr('graphics')
+        if grdevices is None:
+            grdevices = importr('grDevices')
+        self.graphics = graphics
+        self.grdevices = grdevices
+        return
+
+    def _import_rpy2(self):
+
+        try:
+            global rpy2
+            global importr
+            global robjects
+            global r
+            import rpy2
+            from rpy2.robjects.packages import importr
+            import rpy2.robjects as robjects
+            from rpy2.robjects import r
+            success = True
+        except:
+            success = False
+        return success
+
+    def open(self, file_name, onefile = True):
+        self.grdevices.pdf(file_name, onefile = onefile)
+        self.graphics.par(mfrow = robjects.FloatVector([1, 1]),)
+        return
+
+    def _generate_r_colors(self, tag, elements):
+        p = {
+            'rainbow' : list(r.rainbow( elements , start=0.2, end=1 )),
+            'terrain' : list(r('{0}.colors'.format( 'terrain' ))( elements )),
+            'topo'    : list(r('{0}.colors'.format( 'cm' ))( elements )),
+            'heat'    : list(r('{0}.colors'.format( 'heat' ))( elements )),
+        }
+        reverse = False
+        if tag[-2:] == '_r':
+            reverse = True
+            tag = tag[:-2]
+        if tag not in p.keys():
+            print('Do not {0} as color tag, falling back to rainbow')
+            tag = 'rainbow'
+        colors = p[ tag ]
+        if reverse:
+            colors.reverse()
+        return colors
+
+    def draw(self, plot_data, label_colors, color_table):
+        graphics = self.graphics
+        grdevices = self.grdevices
+
+        params = {
+            'pch'  : 19,
+            'cex'  : 0.7,
+            'xlab' : 'Retention Time [min]',
+            'ylab' : 'Abundance [a.u.]',
+            'xlim' : r.c(*plot_data['xlim']),
+            'ylim' : r.c(*plot_data['ylim']),
+            'main' : plot_data['title'],
+            'frame': False
+        }
+
+        graphics.plot(
+            robjects.FloatVector([]),
+            robjects.FloatVector([]),
+            **params
+        )
+
+        for key, value in plot_data['curves'].items():
+            graphics.lines(
+                robjects.FloatVector(value['x']),
+                robjects.FloatVector(value['y']),
+                type = 'l',
+                lwd = 0.7,
+                col = grdevices.palette()[label_colors[key]]
+            )
+
+            graphics.points(
+                robjects.FloatVector(value['x']),
+                robjects.FloatVector(value['y']),
+                col = robjects.StrVector([color_table[i][1] for i in value['ci']]),
+                #col = grdevices.palette()[label_colors[key]],
+                lwd = 0.1,
+                pch = 19
+            )
+
+        # Todo: Check if colors fit to labels above
+        ms2_evidences = plot_data['ms2_evidences']
+        for key, value in ms2_evidences.items():
+            if len(ms2_evidences[key]) > 0:
+                graphics.points(
+                    robjects.FloatVector(ms2_evidences[key]),
+                    robjects.FloatVector([0]*len(ms2_evidences[key])),
+                    col = grdevices.palette()[label_colors[key]],
+                    lwd = 0.1,
+                    pch = 24
+                )
+
+        self._insert_mscore_legend_into_r_plot(color_table)
+        return
+
+    def _insert_mscore_legend_into_r_plot(self, color_table):
+
+        self.graphics.legend(
+            'topright',
+            title = "mScore",
+            legend = r.c(['{0:2.1f}'.format(i / 100.) for i in range(0, 101, 10)]),
+            fill = robjects.StrVector([ color_table[i][1] for i in range(0, 101, 10)]),
+            bty = 'n',
+            xpd = True,
+            cex = 0.7
+        )
+        return
+
+    def close(self):
+        self.grdevices.dev_off()
+        return
+
+
+def _rgb(color):
+    return tuple(channel / 255. for channel in color)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Stage timers, counters and peak memory sampling for pipeline runs
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# seconds between two RSS samples while a stage is running
+RSS_SAMPLE_INTERVAL = 0.1
+
+# counters that are reported per second
+RATE_COUNTERS = ['spectra', 'matches', 'plots']
+
+# profile of the current run, recording only takes place after start()
+_profile = None
+
+
+def _current_rss():
+    # resident set size of this process in bytes, None if unknown
+    try:
+        with open('/proc/self/statm', 'r') as io:
+            return int(io.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def _max_rss(who):
+    # peak RSS reported by the OS in bytes, kB on Linux and bytes on macOS
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(who).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return max_rss
+
+
+class _RSSSampler(threading.Thread):
+
+    def __init__(self, interval):
+        super(_RSSSampler, self).__init__(daemon = True)
+        self.interval = interval
+        self.peak_rss = _current_rss()
+        self._stop_event = threading.Event()
+        return
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = _current_rss()
+            if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                self.peak_rss = rss
+        return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        rss = _current_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+        return self.peak_rss
+
+
+class Profile(object):
+    # list of stage records: name, parent stage, wall and CPU seconds, RSS at
+    # start and peak RSS of the process and its children, counters and rates
+
+    def __init__(self, name = None, sample_interval = None):
+        if sample_interval is None:
+            sample_interval = RSS_SAMPLE_INTERVAL
+        self.name = name
+        self.sample_interval = sample_interval
+        self.started = time.time()
+        self.stages = []
+        self._open_stages = []
+        return
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = {
+            'name'     : name,
+            'parent'   : self._open_stages[-1]['name'] if len(self._open_stages) > 0 else None,
+            'start_rss': _current_rss(),
+            'counters' : {}
+        }
+        self.stages.append(record)
+        self._open_stages.append(record)
+
+        sampler = _RSSSampler(self.sample_interval)
+        sampler.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - wall_start
+            record['cpu_seconds'] = time.process_time() - cpu_start
+            record['peak_rss'] = sampler.stop()
+            record['peak_children_rss'] = _max_rss(resource.RUSAGE_CHILDREN) if resource is not None else None
+            record['rates'] = {
+                '{0}/s'.format(counter): value / record['seconds']
+                for counter, value in record['counters'].items()
+                if counter in RATE_COUNTERS and record['seconds'] > 0
+            }
+            self._open_stages.remove(record)
+        return
+
+    def count(self, counter, n = 1):
+        # counted in the innermost running stage
+        if len(self._open_stages) > 0:
+            counters = self._open_stages[-1]['counters']
+            counters[counter] = counters.get(counter, 0) + n
+        return
+
+    def to_dict(self):
+        return {
+            'name'       : self.name,
+            'started'    : self.started,
+            'seconds'    : time.time() - self.started,
+            'peak_rss'   : _max_rss(resource.RUSAGE_SELF) if resource is not None else None,
+            'python'     : platform.python_version(),
+            'platform'   : platform.platform(),
+            'cpus'       : os.cpu_count(),
+            'stages'     : self.stages
+        }
+
+    def write(self, file_name):
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok = True)
+        with open(file_name, 'w') as io:
+            json.dump(self.to_dict(), io, indent = 2, default = str)
+        return file_name
+
+    def report(self):
+        print('{0:-^100}'.format(' Profile '))
+        print('{0:<30}{1:>12}{2:>12}{3:>14}  {4}'.format('stage', 'wall [s]', 'cpu [s]', 'peak RSS [MB]', 'rates'))
+        for record in self.stages:
+            name = record['name'] if record['parent'] is None else '  ' + record['name']
+            peak_rss = record.get('peak_rss', None)
+            rates = ', '.join(
+                '{0:.1f} {1}'.format(value, rate) for rate, value in sorted(record.get('rates', {}).items())
+            )
+            print('{0:<30}{1:>12.2f}{2:>12.2f}{3:>14}  {4}'.format(
+                name,
+                record.get('seconds', float('nan')),
+                record.get('cpu_seconds', float('nan')),
+                '' if peak_rss is None else '{0:.0f}'.format(peak_rss / 2 ** 20),
+                rates
+            ))
+        return
+
+
+def start(name = None, sample_interval = None):
+    global _profile
+    _profile = Profile(name, sample_interval)
+    return _profile
+
+
+def stop():
+    global _profile
+    profile = _profile
+    _profile = None
+    return profile
+
+
+def stage(name):
+    # context manager timing a stage of the current profile, a no-op if no
+    # profile was started
+    if _profile is None:
+        return _no_stage()
+    return _profile.stage(name)
+
+
+@contextlib.contextmanager
+def _no_stage():
+    yield None
+
+
+def count(counter, n = 1):
+    if _profile is not None:
+        _profile.count(counter, n)
+    return
+
+
+def counted(iterable, counter):
+    # passes items through, counting them in the current stage
+    for item in iterable:
+        count(counter)
+        yield item
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Vectorized peak quantification of elution windows
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import numpy as np
+
+
+AMOUNT_FIELDS = [
+    'max I in window',
+    'max I in window (rt)',
+    'max I in window (score)',
+    'sum I in window',
+    'auc in window'
+]
+
+
+def calc_amounts(rt, i, scores, offsets):
+    # window n spans rt/i/scores[offsets[n]:offsets[n + 1]]; returns one array
+    # per amount field (nan for empty windows) and the has_data mask
+    rt = np.asarray(rt, dtype = np.float64)
+    i = np.asarray(i, dtype = np.float64)
+    scores = np.asarray(scores, dtype = np.float64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+
+    n_windows = len(offsets) - 1
+    lengths = np.diff(offsets)
+    has_data = lengths > 0
+
+    amounts = {field: np.full(n_windows, np.nan) for field in AMOUNT_FIELDS}
+    amounts['has_data'] = has_data
+    if not has_data.any():
+        return amounts
+
+    # only the covered part of the arrays, windows are contiguous in there
+    first, last = offsets[0], offsets[-1]
+    rt = rt[first:last]
+    i = i[first:last]
+    scores = scores[first:last]
+    starts = offsets[:-1][has_data] - first
+    segments = np.repeat(np.arange(len(starts)), lengths[has_data])
+
+    max_i = np.maximum.reduceat(i, starts)
+
+    # first index of the maximum in every window
+    candidates = np.where(i == max_i[segments], np.arange(len(i)), len(i))
+    index_of_max_i = np.minimum.reduceat(candidates, starts)
+
+    # trapezoids between neighbours of the same window
+    trapezoids = np.zeros(len(i))
+    trapezoids[:-1] = np.diff(rt) * (i[1:] + i[:-1]) / 2.
+    trapezoids[:-1][segments[1:] != segments[:-1]] = 0.
+
+    amounts['max I in window'][has_data] = max_i
+    amounts['max I in window (rt)'][has_data] = rt[index_of_max_i]
+    amounts['max I in window (score)'][has_data] = scores[index_of_max_i]
+    amounts['sum I in window'][has_data] = np.add.reduceat(i, starts)
+    amounts['auc in window'][has_data] = np.add.reduceat(trapezoids, starts)
+
+    return amounts
+
+
+def concatenate_windows(objs_for_calc_amount):
+    # list of pyQms calc amount objects -> rt, i, scores, offsets
+    offsets = np.zeros(len(objs_for_calc_amount) + 1, dtype = np.int64)
+    for n, obj_for_calc_amount in enumerate(objs_for_calc_amount):
+        offsets[n + 1] = offsets[n] + len(obj_for_calc_amount['i'])
+
+    rt = np.empty(offsets[-1])
+    i = np.empty(offsets[-1])
+    scores = np.empty(offsets[-1])
+    for n, obj_for_calc_amount in enumerate(objs_for_calc_amount):
+        rt[offsets[n]:offsets[n + 1]] = obj_for_calc_amount['rt']
+        i[offsets[n]:offsets[n + 1]] = obj_for_calc_amount['i']
+        scores[offsets[n]:offsets[n + 1]] = obj_for_calc_amount['scores']
+
+    return rt, i, scores, offsets
+
+
+def calc_amounts_for_windows(objs_for_calc_amount):
+    # batch version of calc_auc, one return dict (or None) per window
+    amounts = calc_amounts(*concatenate_windows(objs_for_calc_amount))
+    columns = [amounts[field].tolist() for field in AMOUNT_FIELDS]
+    return_dicts = []
+    for n, has_data in enumerate(amounts['has_data'].tolist()):
+        if has_data:
+            return_dicts.append({field: column[n] for field, column in zip(AMOUNT_FIELDS, columns)})
+        else:
+            return_dicts.append(None)
+    return return_dicts
+
+
+def calc_auc(obj_for_calc_amount):
+    # per window callback for pyqms calc_amounts_from_rt_info_file
+    return calc_amounts_for_windows([obj_for_calc_amount])[0]
+
+
+def coelution(
+        rt_a,
+        i_a,
+        offsets_a,
+        rt_b,
+        i_b,
+        offsets_b,
+        grid_points = 50
+            ):
+
+    # pair n compares profile a[offsets_a[n]:offsets_a[n + 1]] with the
+    # respective profile b; both are put on a common RT grid spanning the pair
+    # and compared by Pearson correlation and by their overlap. Profiles have
+    # to be sorted by RT. Returns pearson and overlap arrays, nan where a
+    # profile is empty or flat.
+    min_a, max_a = _profile_ranges(rt_a, offsets_a)
+    min_b, max_b = _profile_ranges(rt_b, offsets_b)
+
+    grid_min = np.fmin(min_a, min_b)
+    grid_max = np.fmax(max_a, max_b)
+    grid = grid_min[:, None] + (grid_max - grid_min)[:, None] * np.linspace(0., 1., grid_points)[None, :]
+
+    y_a = _interpolate_profiles(rt_a, i_a, offsets_a, min_a, max_a, grid)
+    y_b = _interpolate_profiles(rt_b, i_b, offsets_b, min_b, max_b, grid)
+
+    # overlap: shared area of both profiles, each normalized to an area of 1
+    sum_a = y_a.sum(axis = 1)[:, None]
+    sum_b = y_b.sum(axis = 1)[:, None]
+    valid = (sum_a[:, 0] > 0) & (sum_b[:, 0] > 0)
+    overlap = np.full(len(valid), np.nan)
+    overlap[valid] = np.minimum(y_a[valid] / sum_a[valid], y_b[valid] / sum_b[valid]).sum(axis = 1)
+
+    y_a = y_a - y_a.mean(axis = 1)[:, None]
+    y_b = y_b - y_b.mean(axis = 1)[:, None]
+    denominator = np.sqrt((y_a * y_a).sum(axis = 1) * (y_b * y_b).sum(axis = 1))
+    pearson = np.full(len(denominator), np.nan)
+    np.divide((y_a * y_b).sum(axis = 1), denominator, out = pearson, where = denominator > 0)
+
+    return pearson, overlap
+
+
+def _profile_ranges(rt, offsets):
+    rt = np.asarray(rt, dtype = np.float64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    lengths = np.diff(offsets)
+    has_data = lengths > 0
+    minima = np.full(len(lengths), np.nan)
+    maxima = np.full(len(lengths), np.nan)
+    if has_data.any():
+        minima[has_data] = rt[offsets[:-1][has_data]]
+        maxima[has_data] = rt[offsets[1:][has_data] - 1]
+    return minima, maxima
+
+
+def _interpolate_profiles(rt, i, offsets, minima, maxima, grid):
+    # all profiles are shifted onto one increasing axis, so that a single
+    # np.interp call interpolates every profile on its own grid row
+    rt = np.asarray(rt, dtype = np.float64)
+    i = np.asarray(i, dtype = np.float64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    values = np.zeros(grid.shape)
+    if offsets[-1] == offsets[0]:
+        return values
+
+    rt = rt[offsets[0]:offsets[-1]]
+    i = i[offsets[0]:offsets[-1]]
+    lengths = np.diff(offsets)
+    segments = np.repeat(np.arange(len(lengths)), lengths)
+
+    rt_min = min(rt.min(), np.nanmin(grid))
+    stride = max(rt.max(), np.nanmax(grid)) - rt_min + 1.
+    shifted_rt = rt - rt_min + segments * stride
+    shifted_grid = grid - rt_min + np.arange(len(lengths))[:, None] * stride
+
+    inside = (grid >= minima[:, None]) & (grid <= maxima[:, None])
+    values[inside] = np.interp(shifted_grid[inside], shifted_rt, i)
+    return values
@@ -13,14 +13,23 @@
         * Stahl, M.
     
 """
+import os
 import sys
 import bisect
+import pickle
 import pyqms
 import codecs
 import csv
+import re
 import math
+import functools
+import multiprocessing
+import numpy as np
 #import climber
 from collections import namedtuple
+import plotting
+from quantification import coelution, calc_amounts, AMOUNT_FIELDS
+from match_store import match, MatchStore, PeakBuffer, write_match_stores, read_match_stores
 
 
 r_key = namedtuple(
@@ -33,14 +42,13 @@ r_key = namedtuple(
     ]
 )
 
-match = namedtuple(
-    'match',
+ratio_batch = namedtuple(
+    'ratio_batch',
     [
-        'spec_id',
-        'rt',
-        'score',
-        'scaling_factor',
-        'peaks'
+        'keys',
+        'numerator',
+        'denominator',
+        'ratio'
     ]
 )
 
@@ -61,14 +69,71 @@ default_body_fields = [
         'label_percentiles'
     ]
 
+META_FILE = 'meta.pkl'
+
+# columns of the quant summary file that end up in a Ratios instance
+quant_summary_fields = ['charge'] + default_body_fields
+
 LABELS_KEY = 'labels'
 CURATION_KEY = 'curation'
 CURATION_FIELDS = {
         'required_matches'    : None,
         'has_required_matches': None,
+        'min_pearson'         : None,
+        'min_overlap'         : None,
+        'pearson'             : None,
+        'overlap'             : None,
+        'coelutes'            : None,
         'curated'             : False
     }
 
+# number of pairs scored together in the coelution check
+COELUTION_CHUNK_SIZE = 20000
+
+@functools.lru_cache(maxsize = None)
+def _label_pattern(labels):
+    return re.compile(
+        r'(?:^|;)({0}):([^;]*)'.format('|'.join(re.escape(label) for label in labels))
+    )
+
+
+@functools.lru_cache(maxsize = 2 ** 20)
+def split_molecule(molecule, labels):
+    # SEQUENCE#mod:pos;label:pos;... -> sequence, label, label position, other mods
+    mod_start = molecule.find('#')
+    mods = molecule[mod_start+1:]
+    
+    label = None
+    label_position = -1
+    found = _label_pattern(labels).search(mods)
+    if found is not None:
+        label, label_position = found.groups()
+    
+    label_mod = '{0}:{1}'.format(label, label_position)
+    mods = ';'.join(mod for mod in mods.split(';') if mod != '' and mod != label_mod)
+    
+    return molecule[:mod_start], label, label_position, mods
+
+
+def index_results(results_class):
+    # one pass over all results, (file_name, formula, charge) -> matches
+    results_index = {}
+    for key, i, entry in results_class.extract_results(
+            molecules         = None,
+            charges           = None,
+            file_names        = None,
+            label_percentiles = None,
+            formulas          = None,
+            score_threshold   = None
+        ):
+        index_key = (key.file_name, key.formula, key.charge)
+        if index_key not in results_index:
+            results_index[index_key] = []
+        results_index[index_key].append(entry)
+    
+    return results_index
+
+
 class Ratios(dict):
     
     def __init__(
@@ -90,6 +155,26 @@ class Ratios(dict):
         self.quant_summary_dicts = None
         self.rt_info_dicts = None
         
+        # peaks of all label entries share one buffer
+        self.peak_buffer = PeakBuffer()
+        
+        self._score_colors = None
+        
+        # secondary indexes, kept up to date by add_body:
+        # sequence -> keys, trivial name -> keys, (sequence, label position) -> keys;
+        # protein keys are a dict used as insertion ordered set, since every
+        # label of a key adds it again
+        self.sequence_index = {}
+        self.protein_index = {}
+        self.site_index = {}
+        
+        # amount fields are parsed to floats once by add_body: every key gets
+        # a row in add order, every label the rows and values of its entries;
+        # _get_quant_column turns them into arrays, nan where not a number
+        self._key_rows = {}
+        self._quant_values = {}
+        self._quant_columns = {}
+        
         return
     
     
@@ -100,32 +185,102 @@ class Ratios(dict):
                 quant_field
                     ):
         
-        for key, value in self.items():
-            result = 0.0
-            
-            try:
-                float1 = float(value[label1][quant_field])
-            except (KeyError, ValueError, TypeError):
-                float1 = 0.0
-            
-            try:
-                float2 = float(value[label2][quant_field])
-            except (KeyError, ValueError, TypeError):
-                float2 = 0.0
+        batch = self.calculate_ratio_batch([(label1, label2)], [quant_field])[(label1, label2, quant_field)]
+        for key, ratio in zip(batch.keys, batch.ratio.tolist()):
+            yield key, ratio
+    
+    
+    def calculate_ratio_batch(
+                self,
+                label_pairs,
+                quant_fields,
+                key_list = None
+                    ):
+        
+        # rows of the keys in the quant columns, None for all keys
+        rows = None
+        if key_list is None:
+            key_list = list(self.keys())
+        else:
+            rows = np.fromiter(
+                (self._key_rows[key] for key in key_list),
+                dtype = np.int64,
+                count = len(key_list)
+            )
+        
+        keys = np.empty(len(key_list), dtype = object)
+        for n, key in enumerate(key_list):
+            keys[n] = key
+        
+        columns = {}
+        for label_pair in label_pairs:
+            for label in label_pair:
+                for quant_field in quant_fields:
+                    if (label, quant_field) not in columns:
+                        columns[(label, quant_field)] = self._get_quant_column(rows, label, quant_field)
+        
+        batches = {}
+        for label1, label2 in label_pairs:
+            for quant_field in quant_fields:
+                numerator = columns[(label1, quant_field)]
+                denominator = columns[(label2, quant_field)]
                 
-            try:
-                result = float1/float2
-            except ZeroDivisionError:
-                result = 20.0
-            except:
-                print('Unknown error in ratio calculation!')
-            
-            #print(float1, float2)
-            if float1 == 0.0 and float2 == 0.0:
-                yield key, 0.0
-                continue
-            
-            yield key, result
+                # x/0 is 20.0 and 0/0 is 0.0
+                ratio = np.full(len(key_list), 20.0)
+                np.divide(numerator, denominator, out = ratio, where = denominator != 0.0)
+                ratio[(numerator == 0.0) & (denominator == 0.0)] = 0.0
+                
+                batches[(label1, label2, quant_field)] = ratio_batch(keys, numerator, denominator, ratio)
+        
+        return batches
+    
+    
+    def _get_quant_column(
+            self,
+            rows,
+            label,
+            quant_field
+                ):
+        
+        # values of the given key rows (None for all keys), missing or
+        # invalid values are 0.0
+        if (label, quant_field) not in self._quant_columns:
+            column = np.full(len(self._key_rows), np.nan)
+            label_rows, values = self._quant_values.get(label, ([], {}))
+            if quant_field in values:
+                column[label_rows] = values[quant_field]
+            else:
+                # fields besides the amount fields are parsed on request
+                for key, row in self._key_rows.items():
+                    label_value = self[key][LABELS_KEY].get(label, {})
+                    column[row] = _parse_float(label_value.get(quant_field, None))
+            self._quant_columns[(label, quant_field)] = column
+        
+        if rows is None:
+            column = self._quant_columns[(label, quant_field)].copy()
+        else:
+            column = self._quant_columns[(label, quant_field)][rows]
+        column[np.isnan(column)] = 0.0
+        
+        return column
+    
+    
+    def _add_quant_values(
+            self,
+            r_key,
+            label,
+            info
+                ):
+        
+        if label not in self._quant_values:
+            self._quant_values[label] = ([], {field: [] for field in AMOUNT_FIELDS})
+        label_rows, values = self._quant_values[label]
+        label_rows.append(self._key_rows[r_key])
+        for field in AMOUNT_FIELDS:
+            values[field].append(_parse_float(info.get(field, None)))
+        self._quant_columns.clear()
+        return
+    
     
     def add_body(
             self, 
@@ -139,11 +294,22 @@ class Ratios(dict):
         if r_key in self:
             if label not in self[r_key][LABELS_KEY]:
                 self[r_key][LABELS_KEY].update({label: info})
+                self._add_quant_values(r_key, label, info)
         else:
             self[r_key] = {}
             self[r_key][LABELS_KEY] = {
                     label: info
                 }
+            self._key_rows[r_key] = len(self._key_rows)
+            self._add_quant_values(r_key, label, info)
+            self.sequence_index.setdefault(r_key.sequence, []).append(r_key)
+            self.site_index.setdefault((r_key.sequence, r_key.label_position), []).append(r_key)
+        
+        for trivial_name in info.get('trivial_name(s)', '').split(';'):
+            trivial_name = trivial_name.strip()
+            if trivial_name == '':
+                continue
+            self.protein_index.setdefault(trivial_name, {})[r_key] = None
         
         return r_key
     
@@ -167,15 +333,10 @@ class Ratios(dict):
         if labels is not None:
             self.labels = labels
         
-        
-        if self.rt_info_file is not None:
-            self.rt_info_dicts = self._get_dicts_from_file(self.rt_info_file)
-             
-        if self.quant_summary_file is not None:
-            self.quant_summary_dicts = self._get_dicts_from_file(self.quant_summary_file)
-        
-        # read summary file dict in common data structure
-        for line in self.quant_summary_dicts:
+        # the rt info file is not needed for parsing and is only read on
+        # request via _get_dicts_from_file; quant summary rows are streamed
+        # into the common data structure, keeping only the required columns
+        for line in self._iter_dicts_from_file(self.quant_summary_file, fields = quant_summary_fields):
             molecule, label, label_position, mods = self._split_molecule(line['molecule'])
             self.add_body(
                     key = (molecule, line['charge'], label_position, mods),
@@ -185,72 +346,173 @@ class Ratios(dict):
         
         # match results class to quant summary
         print('> Evaluating {0} peptide tuples...'.format(len(self)))
+        results_index = self._index_results(self.results_class)
         for result_key, result_value in self.items():
+            charge = int(result_key[1])
             for label_key, label_value in result_value[LABELS_KEY].items():
-                for key, i, entry in self.results_class.extract_results(
-                        molecules         = None,
-                        charges           = [int(result_key[1])],
-                        file_names        = label_value['file_name'],
-                        label_percentiles = None,
-                        formulas          = label_value['formula'],
-                        score_threshold   = None
-                    ):
-                    self[result_key][LABELS_KEY][label_key]['data'].append(entry)
-                self[result_key][LABELS_KEY][label_key]['len_data'] = len(self[result_key][LABELS_KEY][label_key]['data'])
+                label_value['data'] = MatchStore.from_matches(
+                    results_index.get((label_value['file_name'], label_value['formula'], charge), []),
+                    self.peak_buffer
+                )
+                label_value['len_data'] = len(label_value['data'])
             
             self[result_key][CURATION_KEY] = CURATION_FIELDS.copy()
             
         return
 
 
+    def save(
+            self,
+            folder
+                ):
+        
+        # match data is written to memory-mappable arrays, everything else
+        # (keys, label infos, curation) to a small pickle
+        entries = []
+        stores = []
+        for key, value in self.items():
+            label_infos = {}
+            for label_key, label_value in value[LABELS_KEY].items():
+                info = {field: field_value for field, field_value in label_value.items() if field != 'data'}
+                label_infos[label_key] = info
+                stores.append(label_value['data'])
+            entries.append((tuple(key), label_infos, value.get(CURATION_KEY, None)))
+        
+        slices = write_match_stores(stores, folder)
+        meta = {
+            'quant_summary_file': self.quant_summary_file,
+            'rt_info_file'      : self.rt_info_file,
+            'labels'            : self.labels,
+            'entries'           : entries,
+            'slices'            : slices
+        }
+        with open(os.path.join(folder, META_FILE), 'wb') as meta_file:
+            pickle.dump(meta, meta_file, protocol = pickle.HIGHEST_PROTOCOL)
+        
+        return
+    
+    
+    @classmethod
+    def load(
+            cls,
+            folder,
+            results_class = None,
+            mmap_mode     = 'r'
+                ):
+        
+        with open(os.path.join(folder, META_FILE), 'rb') as meta_file:
+            meta = pickle.load(meta_file)
+        
+        ratios = cls(
+            quant_summary_file = meta['quant_summary_file'],
+            rt_info_file       = meta['rt_info_file'],
+            results_class      = results_class,
+            labels             = meta['labels']
+        )
+        stores = iter(read_match_stores(folder, meta['slices'], mmap_mode = mmap_mode))
+        for key, label_infos, curation in meta['entries']:
+            for label_key, info in label_infos.items():
+                info['data'] = next(stores)
+                r_key = ratios.add_body(key, label_key, info)
+            if curation is not None:
+                ratios[r_key][CURATION_KEY] = curation
+        
+        return ratios
+    
+    
+    def _index_results(
+            self,
+            results_class
+                ):
+        
+        return index_results(results_class)
+    
+    
     def _get_dicts_from_file(
             self, 
             file
                 ):
         
-        tmp_dicts = []
+        return list(self._iter_dicts_from_file(file))
+    
+    
+    def _iter_dicts_from_file(
+            self,
+            file,
+            fields = None
+                ):
+        
         if file.endswith('.csv'):
-            with codecs.open(file, mode='r', encoding='utf-8'  ) as rif:
-                dict_reader = csv.DictReader(rif)
-                for line_dict in dict_reader:
-                    tmp_dicts.append(line_dict)
+            rows = self._iter_csv_rows(file)
         elif file.endswith('.xlsx'):
-            tmp_dicts = pyqms.adaptors.read_xlsx_file(file)
+            rows = self._iter_xlsx_rows(file)
         else:
             print('Extension: {0} of file {1} not recognized'.format(file.split('.')[-1], file))
             exit(1)
         
-        return tmp_dicts
+        for line_dict in rows:
+            if fields is not None:
+                line_dict = {field: line_dict[field] for field in fields}
+            yield line_dict
+    
+    
+    def _iter_csv_rows(
+            self,
+            file
+                ):
+        
+        with codecs.open(file, mode='r', encoding='utf-8'  ) as rif:
+            dict_reader = csv.DictReader(rif)
+            for line_dict in dict_reader:
+                yield line_dict
+    
+    
+    def _iter_xlsx_rows(
+            self,
+            file
+                ):
+        
+        # openpyxl's read only mode streams the rows, pyqms reads the whole sheet
+        try:
+            import openpyxl
+        except ImportError:
+            for line_dict in pyqms.adaptors.read_xlsx_file(file):
+                yield line_dict
+            return
+        
+        workbook = openpyxl.load_workbook(file, read_only = True, data_only = True)
+        try:
+            rows = workbook.active.iter_rows(values_only = True)
+            header = next(rows, None)
+            if header is None:
+                return
+            for row in rows:
+                yield {
+                    field: self._format_cell(value) for field, value in zip(header, row)
+                }
+        finally:
+            workbook.close()
+    
+    
+    def _format_cell(
+            self,
+            value
+                ):
+        
+        # cells are handed on as strings, like the csv reader does
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
     
     
     def _split_molecule(
             self,
             molecule
                 ):
-    
-        label = None
-        label_position = -1
-        mod_start = molecule.find('#')
-        for label_name in self.labels:
-            pos = molecule.find(label_name)
-            if pos >= 0:
-                label = label_name
-                sub_string_label = molecule[pos+len(label_name)+1:]
-                pos_end_label = sub_string_label.find(';')
-                if pos_end_label >= 0:
-                    label_position = sub_string_label[:sub_string_label.find(';')]
-                else:
-                    label_position = sub_string_label
-                break
-        
-        mods = molecule[mod_start+1:].replace('{0}:{1}'.format(label, label_position), '')
-        mods = mods.replace(';;', ';')
-        if mods[0:1] == ';':
-            mods = mods[1:]
-        elif mods[-1:] == ';':
-            mods = mods[:-1]
-            
-        return molecule[:mod_start], label, label_position, mods
+        
+        return split_molecule(molecule, tuple(self.labels))
     
     
     def _extract_molecule_info(
@@ -263,6 +525,7 @@ class Ratios(dict):
             tmp[field_name] = line[field_name]
         
         tmp['data'] = []
+        tmp['rt_window'] = _parse_rt_window(tmp)
         
         if tmp['trivial_name(s)'].find('no MS2;') >= 0:
             tmp['has_MS2_id'] = False
@@ -273,55 +536,6 @@ class Ratios(dict):
         return tmp
     
     
-    def _import_rpy2(self):
-        
-        try:
-            global rpy2
-            global importr
-            global robjects
-            global r
-            global graphics
-            global grdevices
-            import rpy2
-            from rpy2.robjects.packages import importr
-            import rpy2.robjects as robjects
-            from rpy2.robjects import r
-            graphics = importr('graphics')
-            grdevices = importr('grDevices')
-            success = True
-        except:
-            success = False
-        return success
-    
-    
-    def _init_r_plot(self, file_name):
-        assert self._import_rpy2() is True, 'require R & rpy2 installed...'
-        graphics = importr('graphics')
-        grdevices = importr('grDevices')
-        grdevices.pdf(file_name)
-        return graphics, grdevices
-    
-    
-    def _generate_r_colors(self, tag, elements):
-        p = {
-            'rainbow' : list(r.rainbow( elements , start=0.2, end=1 )),
-            'terrain' : list(r('{0}.colors'.format( 'terrain' ))( elements )),
-            'topo'    : list(r('{0}.colors'.format( 'cm' ))( elements )),
-            'heat'    : list(r('{0}.colors'.format( 'heat' ))( elements )),
-        }
-        reverse = False
-        if tag[-2:] == '_r':
-            reverse = True
-            tag = tag[:-2]
-        if tag not in p.keys():
-            print('Do not {0} as color tag, falling back to rainbow')
-            tag = 'rainbow'
-        colors = p[ tag ]
-        if reverse:
-            colors.reverse()
-        return colors
-    
-    
     def colorize_score(self, score ):
         
         color = [0, 0, 0]
@@ -346,6 +560,22 @@ class Ratios(dict):
         return color, hexed_color
 
 
+    def score_colors(self):
+        
+        return [hex_col for rgb_col, hex_col in self.score_color_table()]
+    
+    
+    def score_color_table(self):
+        
+        # lookup table of 101 (rgb, hex) colors for mScores 0.00 ... 1.00, built once
+        if self._score_colors is None:
+            colors = []
+            for n in range(0, 101, 1):
+                colors.append(self.colorize_score(n/100))
+            self._score_colors = colors
+        return self._score_colors
+    
+    
     def plot_pairs(
             self,
             key_list,
@@ -355,182 +585,282 @@ class Ratios(dict):
             xlimits            = None,
             title              = None,
             grdevices          = None,
-            graphics           = None
+            graphics           = None,
+            backend            = None
                 ):
-
-        zlimits = [0, 1]
-        zlimits_color_ints = [
-            math.floor(zlimits[0]*100.0),
-            math.ceil(zlimits[-1]*100.0)
-        ]       
-        
-        if rt_offset is None:
-            rt_offset = 6.0
-        
-        colors = []
         
-        for n in range(0, 101, 1):
-            rgb_col, hex_col =  self.colorize_score(n/100)
-            colors.append(hex_col)
+        # graphics and grdevices are only used by the R backend
+        if graphics is not None or grdevices is not None:
+            backend = plotting.RPlotBackend(graphics, grdevices)
         
+        device_opened = False
         for n, key in enumerate(key_list):
             
-            if key not in self.keys():
-                print('Warning, do not have match results for {0}'.format(key))
+            plot_data = self._collect_plot_data(key, rt_offset, xlimits)
+            if plot_data is None:
                 continue
-
-            if self[key][CURATION_KEY]['curated'] and self[key][CURATION_KEY]['has_required_matches'] == False:
-                continue 
-            
-            ms2_evidences = {}
             
-            curve_dict = {}
+            if not device_opened:
+                backend = plotting.get_backend(backend)
+                backend.open(file_name)
+                device_opened = True
             
-            for label_key, label_value in self[key][LABELS_KEY].items():
-                
-                if label_value['has_MS2_id'] == True:
-                    ms2_evidences[label_key] = self._parse_evidences(label_value['evidences (min)'])
-                
-                x = []
-                y = []
-                s = []
-                c = []
-                for entry in label_value['data']:
-                    if float(label_value['start (min)']) - rt_offset <= entry.rt <= float(label_value['stop (min)']) + rt_offset:
-                        x.append(entry.rt)
-                        y.append(entry.scaling_factor)
-                        s.append(entry.score)
-                        
-                if len(x) < 3:
-                    continue
-                
-                for score in s:
-                    c.append(colors[int(round(score*100))])
-            
-                if xlimits is None:
-                    xlimits = [x[0], x[-1]]
-                    
-                curve_dict.update({
-                        label_key: {
-                                'x': x,
-                                'y': y,
-                                's': s,
-                                'c': c,
-                                'max_y': max(y),
-                                'xlimits': xlimits
-                            }
-                    })
-
-            if len(ms2_evidences) == 0:
-                continue
-            
-            max_list = []
-            min_xlimits_list = []
-            max_xlimits_list = []
-            for label_key, label_value in curve_dict.items():
-                max_list.append(label_value['max_y'])
-                if label_value['xlimits'] is not None:
-                    min_xlimits_list.append(label_value['xlimits'][0])
-                    max_xlimits_list.append(label_value['xlimits'][-1])
-            
-            if max_list == [] or min_xlimits_list == []:
+            backend.draw(plot_data, label_colors, self.score_color_table())
+        
+        if device_opened:
+            backend.close()
+
+        return backend
+    
+    
+    def plot_pairs_batch(
+            self,
+            key_list,
+            file_name,
+            label_colors,
+            rt_offset          = None,
+            one_file_per_key   = False,
+            workers            = None,
+            backend            = None
+                ):
+        
+        # one_file_per_key = False writes one page per key into file_name,
+        # otherwise file_name is formatted with sequence and charge of each
+        # key; with workers > 1 the keys are split across a process pool, each
+        # worker writing its own part file in the multi-page case; backend is
+        # a name here, so that every worker can set up its own
+        key_list = list(key_list)
+        
+        if workers is None or workers <= 1:
+            return self._plot_batch(key_list, file_name, label_colors, rt_offset, one_file_per_key, backend)
+        
+        global _plotting_ratios
+        _plotting_ratios = self
+        
+        tasks = []
+        chunk_size = int(math.ceil(len(key_list) / workers))
+        for n in range(workers):
+            chunk = key_list[n * chunk_size:(n + 1) * chunk_size]
+            if len(chunk) == 0:
                 continue
+            if one_file_per_key:
+                part_file_name = file_name
+            else:
+                base, extension = os.path.splitext(file_name)
+                part_file_name = '{0}_part{1}{2}'.format(base, n, extension)
+            tasks.append((chunk, part_file_name, label_colors, rt_offset, one_file_per_key, backend, n))
+        
+        written_files = []
+        # fork, so that workers inherit the instance instead of unpickling it
+        with multiprocessing.get_context('fork').Pool(processes = workers) as pool:
+            for part_files in pool.imap(_plot_batch_worker, tasks):
+                written_files.extend(part_files)
+        
+        return written_files
+    
+    
+    def _plot_batch(
+            self,
+            key_list,
+            file_name,
+            label_colors,
+            rt_offset,
+            one_file_per_key,
+            backend = None,
+            part    = None
+                ):
+        
+        # part numbers the page files of parallel workers, which all get the
+        # same file_name with one_file_per_key
+        plots = []
+        for key in key_list:
+            plot_data = self._collect_plot_data(key, rt_offset)
+            if plot_data is not None:
+                plots.append(plot_data)
+        
+        if len(plots) == 0:
+            return []
+        
+        backend = plotting.get_backend(backend)
+        if one_file_per_key:
+            # one device writes every page to its own numbered file, which
+            # are renamed to the key names afterwards
+            base, extension = os.path.splitext(file_name)
+            if part is not None:
+                base = '{0}_part{1}'.format(base, part)
+            page_file_name = '{0}_page%06d{1}'.format(base, extension)
+            backend.open(page_file_name, onefile = False)
+        else:
+            backend.open(file_name)
+        
+        color_table = self.score_color_table()
+        for n, plot_data in enumerate(plots, 1):
+            backend.draw(plot_data, label_colors, color_table)
+            if n % 20 == 0:
+                print('> Plot tuples:', n, end = '\r')
+        backend.close()
+        
+        if not one_file_per_key:
+            return [file_name]
+        
+        written_files = []
+        for n, plot_data in enumerate(plots, 1):
+            key = plot_data['key']
+            key_file_name = file_name.format(key[0], key[1])
+            os.replace(page_file_name % n, key_file_name)
+            written_files.append(key_file_name)
+        return written_files
+    
+    
+    def _collect_plot_data(
+            self,
+            key,
+            rt_offset = None,
+            xlimits   = None
+                ):
+        
+        if rt_offset is None:
+            rt_offset = 6.0
+        
+        colors = self.score_colors()
+        
+        if key not in self.keys():
+            print('Warning, do not have match results for {0}'.format(key))
+            return None
+
+        if self[key][CURATION_KEY]['curated'] and self[key][CURATION_KEY]['has_required_matches'] == False:
+            return None
+        
+        if self[key][CURATION_KEY]['curated'] and self[key][CURATION_KEY].get('coelutes', None) == False:
+            return None
+        
+        ms2_evidences = {}
+        
+        curve_dict = {}
+        
+        for label_key, label_value in self[key][LABELS_KEY].items():
             
-            if grdevices is None or graphics is None:
-                graphics, grdevices = self._init_r_plot(file_name)
-            
-            graphics.par(mfrow = robjects.FloatVector([len(key_list), 1]),)
-            
-            max_y = max(max_list)
-            min_x_limit = min(min_xlimits_list) - 1
-            max_x_limit = max(max_xlimits_list) + 1
-            
-            all_evidences = []
-            for evidences in ms2_evidences.values():
-                all_evidences.append(evidences)
-            
-            if len(all_evidences) > 0:
-                min_all_evidences = float(min(all_evidences)[0])
-                max_all_evidences = float(max(all_evidences)[0])
-                    
-                if min_x_limit > min_all_evidences:
-                    min_x_limit = min_all_evidences - 1
-                if max_x_limit < max_all_evidences:
-                    max_x_limit = max_all_evidences + 1
-            
-            params = {
-                'pch'  : 19,
-                'cex'  : 0.7,
-                'xlab' : 'Retention Time [min]',
-                'ylab' : 'Abundance [a.u.]',
-                'xlim' : r.c(min_x_limit, max_x_limit),
-                'ylim' : r.c(0, max_y * 1.1),
-                'main' : '{0}\n Charge: {1}\n Mods: {2}'.format(key[0][:int(key[2])]+'*'+key[0][int(key[2]):], key[1], key[3]),
-                'frame': False
-            }
-            
-            graphics.plot(
-                robjects.FloatVector([]),
-                robjects.FloatVector([]),
-                **params
-            )
-            
-            for key, value in curve_dict.items():
-                graphics.lines(
-                    robjects.FloatVector(value['x']),
-                    robjects.FloatVector(value['y']),
-                    type = 'l',
-                    lwd = 0.7,
-                    col = grdevices.palette()[label_colors[key]]
-                )
-                    
-                graphics.points(
-                    robjects.FloatVector(value['x']),
-                    robjects.FloatVector(value['y']),
-                    col = robjects.StrVector(value['c']),
-                    #col = grdevices.palette()[label_colors[key]],
-                    lwd = 0.1,
-                    pch = 19
-                )
+            if label_value['has_MS2_id'] == True:
+                ms2_evidences[label_key] = self._parse_evidences(label_value['evidences (min)'])
             
-            # Todo: Check if colors fit to labels above
-            for key, value in ms2_evidences.items():
-                if len(ms2_evidences[key]) > 0:
-                    graphics.points(
-                        robjects.FloatVector(ms2_evidences[key]),
-                        robjects.FloatVector([0]*len(ms2_evidences[key])),
-                        col = grdevices.palette()[label_colors[key]],
-                        lwd = 0.1,
-                        pch = 24
-                    )
+            window = self.get_window(label_value, rt_offset)
+            x = window.rt.tolist()
+            y = window.scaling_factor.tolist()
+            s = window.score.tolist()
+            ci = [int(round(score*100)) for score in s]
+            c = [colors[i] for i in ci]
                     
-            graphics = self._insert_mscore_legend_into_r_plot(
-                graphics,
-                colors,
-                zlimits_color_ints
-            )
-            
-            grdevices.dev_off()
+            if len(x) < 3:
+                continue
+        
+            if xlimits is None:
+                xlimits = [x[0], x[-1]]
+                
+            curve_dict.update({
+                    label_key: {
+                            'x': x,
+                            'y': y,
+                            's': s,
+                            'c': c,
+                            'ci': ci,
+                            'max_y': max(y),
+                            'xlimits': xlimits
+                        }
+                })
 
-        return grdevices
+        if len(ms2_evidences) == 0:
+            return None
+        
+        max_list = []
+        min_xlimits_list = []
+        max_xlimits_list = []
+        for label_key, label_value in curve_dict.items():
+            max_list.append(label_value['max_y'])
+            if label_value['xlimits'] is not None:
+                min_xlimits_list.append(label_value['xlimits'][0])
+                max_xlimits_list.append(label_value['xlimits'][-1])
+        
+        if max_list == [] or min_xlimits_list == []:
+            return None
+        
+        max_y = max(max_list)
+        min_x_limit = min(min_xlimits_list) - 1
+        max_x_limit = max(max_xlimits_list) + 1
+        
+        all_evidences = []
+        for evidences in ms2_evidences.values():
+            all_evidences.append(evidences)
+        
+        if len(all_evidences) > 0:
+            min_all_evidences = float(min(all_evidences)[0])
+            max_all_evidences = float(max(all_evidences)[0])
+                
+            if min_x_limit > min_all_evidences:
+                min_x_limit = min_all_evidences - 1
+            if max_x_limit < max_all_evidences:
+                max_x_limit = max_all_evidences + 1
+        
+        return {
+            'key'          : key,
+            'title'        : '{0}\n Charge: {1}\n Mods: {2}'.format(key[0][:int(key[2])]+'*'+key[0][int(key[2]):], key[1], key[3]),
+            'curves'       : curve_dict,
+            'ms2_evidences': ms2_evidences,
+            'xlim'         : (min_x_limit, max_x_limit),
+            'ylim'         : (0, max_y * 1.1)
+        }
     
-    def _insert_mscore_legend_into_r_plot(
-            self, 
-            graphics, 
-            colors, 
-            zlimits_color_ints
+    
+    def get_window(
+            self,
+            label_value,
+            rt_offset = 0.0
                 ):
         
-        graphics.legend(
-            'topright',
-            title = "mScore",
-            legend = r.c(['{0:2.1f}'.format(i / 100.) for i in range(zlimits_color_ints[0],zlimits_color_ints[1]+1, 10)]),
-            fill = robjects.StrVector([ colors[i] for i in range(0, zlimits_color_ints[-1] - zlimits_color_ints[0]+1, 10)]),
-            bty = 'n',
-            xpd = True,
-            cex = 0.7
+        # matches of a label entry within its quantification window widened
+        # by rt_offset; the window bounds are parsed once per entry
+        if 'rt_window' not in label_value:
+            label_value['rt_window'] = _parse_rt_window(label_value)
+        start, stop = label_value['rt_window']
+        return label_value['data'].window(start - rt_offset, stop + rt_offset)
+    
+    
+    def calc_window_amounts(
+            self,
+            key_list  = None,
+            rt_offset = 0.0
+                ):
+        
+        # amounts of all label entries within their windows in one vectorized
+        # pass, key -> label -> amount fields (None without matches)
+        if key_list is None:
+            key_list = self.keys()
+        
+        entries = []
+        windows = []
+        for key in key_list:
+            for label_key, label_value in self[key][LABELS_KEY].items():
+                entries.append((key, label_key))
+                windows.append(self.get_window(label_value, rt_offset))
+        
+        offsets = np.zeros(len(windows) + 1, dtype = np.int64)
+        offsets[1:] = np.cumsum([len(window) for window in windows])
+        amounts = calc_amounts(
+            np.concatenate([np.zeros(0)] + [window.rt for window in windows]),
+            np.concatenate([np.zeros(0)] + [window.scaling_factor for window in windows]),
+            np.concatenate([np.zeros(0)] + [window.score for window in windows]),
+            offsets
         )
-        return graphics
+        
+        columns = [amounts[field].tolist() for field in AMOUNT_FIELDS]
+        window_amounts = {}
+        for n, ((key, label_key), has_data) in enumerate(zip(entries, amounts['has_data'].tolist())):
+            if has_data:
+                label_amounts = {field: column[n] for field, column in zip(AMOUNT_FIELDS, columns)}
+            else:
+                label_amounts = None
+            window_amounts.setdefault(key, {})[label_key] = label_amounts
+        
+        return window_amounts
     
     
     def _parse_evidences(self,
@@ -550,26 +880,56 @@ class Ratios(dict):
             labels_only = True
                 ):
         
-        keys = []
-        for key in self.keys():
-            if key[0] == sequence:
-                if labels_only:
-                    yield key, self[key][LABELS_KEY]
-                else:
-                    yield key, self[key]
+        for key in self.sequence_index.get(sequence, []):
+            if labels_only:
+                yield key, self[key][LABELS_KEY]
+            else:
+                yield key, self[key]
+    
+    
+    def get_results_by_protein(
+            self,
+            trivial_name,
+            labels_only = True
+                ):
+        
+        for key in self.protein_index.get(trivial_name, []):
+            if labels_only:
+                yield key, self[key][LABELS_KEY]
+            else:
+                yield key, self[key]
+    
+    
+    def get_labelled_sites(
+            self,
+            trivial_name
+                ):
+        
+        # all labelled sites of a protein, (sequence, label position) -> keys
+        # over all charges and other modifications
+        sites = {}
+        for key in self.protein_index.get(trivial_name, []):
+            site = (key.sequence, key.label_position)
+            if site not in sites:
+                sites[site] = self.site_index[site]
+        return sites
     
     
     def curate_pairs(
             self,
             min_matches   = 3,
-            min_pearson   = 0.8,
+            min_pearson   = None,
             key_list      = None,
-            force         = True
+            force         = True,
+            min_overlap   = None
                 ):
         
+        # the coelution check only runs with min_pearson or min_overlap, pairs
+        # that fail it are left out of the plots
         if key_list is None:
             key_list = self.keys()
         
+        coelution_keys = []
         for key in key_list:
             # Check if curation has already taken place, skip curation if force == False
             if self[key][CURATION_KEY]['curated'] and force == False:
@@ -579,10 +939,73 @@ class Ratios(dict):
             self[key][CURATION_KEY]['required_matches'] = min_matches
             self[key][CURATION_KEY]['has_required_matches'] = self._has_required_matches(key, min_matches)
             
-            # Todo: other curation types, e.g. coelution profile and overlap
-        
-            self[key][CURATION_KEY]['curated'] = True
+            for field in ['min_pearson', 'min_overlap', 'pearson', 'overlap', 'coelutes']:
+                self[key][CURATION_KEY][field] = None
             
+            self[key][CURATION_KEY]['curated'] = True
+            coelution_keys.append(key)
+        
+        if min_pearson is None and min_overlap is None:
+            return
+        
+        # Check coelution profile and overlap, batched over all pairs
+        for n in range(0, len(coelution_keys), COELUTION_CHUNK_SIZE):
+            self._curate_coelution(coelution_keys[n:n + COELUTION_CHUNK_SIZE], min_pearson, min_overlap)
+        
+        n_dropped = sum(1 for key in coelution_keys if self[key][CURATION_KEY]['coelutes'] == False)
+        print('> {0} of {1} pairs do not coelute and are left out of the plots'.format(n_dropped, len(coelution_keys)))
+        
+        return
+    
+    
+    def _curate_coelution(
+            self,
+            key_list,
+            min_pearson,
+            min_overlap
+                ):
+        
+        if len(self.labels) != 2:
+            return
+        
+        profiles = {label: ([], [], [0]) for label in self.labels}
+        pair_keys = []
+        for key in key_list:
+            curation = self[key][CURATION_KEY]
+            curation['min_pearson'] = min_pearson
+            curation['min_overlap'] = min_overlap
+            curation['pearson'] = None
+            curation['overlap'] = None
+            curation['coelutes'] = False
+            if len(self[key][LABELS_KEY]) != 2:
+                continue
+            pair_keys.append(key)
+            for label in self.labels:
+                label_value = self[key][LABELS_KEY][label]
+                window = self.get_window(label_value)
+                rts, intensities, offsets = profiles[label]
+                rts.append(window.rt)
+                intensities.append(window.scaling_factor)
+                offsets.append(offsets[-1] + len(window))
+        
+        if len(pair_keys) == 0:
+            return
+        
+        columns = []
+        for label in self.labels:
+            rts, intensities, offsets = profiles[label]
+            columns.extend([np.concatenate(rts), np.concatenate(intensities), np.array(offsets)])
+        pearson, overlap = coelution(*columns)
+        
+        for key, key_pearson, key_overlap in zip(pair_keys, pearson.tolist(), overlap.tolist()):
+            curation = self[key][CURATION_KEY]
+            curation['pearson'] = None if math.isnan(key_pearson) else key_pearson
+            curation['overlap'] = None if math.isnan(key_overlap) else key_overlap
+            coelutes = curation['pearson'] is not None and (min_pearson is None or key_pearson >= min_pearson)
+            if min_overlap is not None:
+                coelutes = coelutes and curation['overlap'] is not None and key_overlap >= min_overlap
+            curation['coelutes'] = coelutes
+        
         return
     
     
@@ -602,16 +1025,25 @@ class Ratios(dict):
                     break
     
         return min_matches_reached
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _parse_rt_window(label_value):
+    try:
+        return float(label_value['start (min)']), float(label_value['stop (min)'])
+    except (KeyError, TypeError, ValueError):
+        return math.nan, math.nan
+
+
+# instance inherited by forked plotting workers
+_plotting_ratios = None
+
+def _plot_batch_worker(args):
+    key_list, file_name, label_colors, rt_offset, one_file_per_key, backend, part = args
+    return _plotting_ratios._plot_batch(key_list, file_name, label_colors, rt_offset, one_file_per_key, backend, part)
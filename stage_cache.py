@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Content-addressed cache for pipeline stages writing files
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import json
+import shutil
+import hashlib
+
+
+MANIFEST_FILE = 'manifest.json'
+HASH_BLOCK_SIZE = 2 ** 20
+
+
+class StageCache(object):
+    # a stage is identified by its name, the hashes of its input files and
+    # its params; its output files are stored under that key and copied back
+    # to their original location when the same stage is run again
+
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        self._file_hashes = {}
+        return
+
+    def file_hash(self, file_name):
+        # memoized by path, size and modification time
+        stat = os.stat(file_name)
+        memo_key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._file_hashes:
+            sha = hashlib.sha256()
+            with open(file_name, 'rb') as io:
+                for block in iter(lambda: io.read(HASH_BLOCK_SIZE), b''):
+                    sha.update(block)
+            self._file_hashes[memo_key] = sha.hexdigest()
+        return self._file_hashes[memo_key]
+
+    def stage_key(self, stage, input_files, params):
+        description = {
+            'stage' : stage,
+            'inputs': [self.file_hash(input_file) for input_file in input_files],
+            'params': params
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys = True, default = str).encode('utf-8')
+        ).hexdigest()
+
+    def run(self, stage, input_files, params, function, *args, **kwargs):
+        # function returns the path of its output file or a list of paths
+        stage_folder = os.path.join(self.cache_folder, stage, self.stage_key(stage, input_files, params))
+        manifest_file = os.path.join(stage_folder, MANIFEST_FILE)
+
+        outputs = self._restore(stage_folder, manifest_file)
+        if outputs is not None:
+            print('> Reusing cached {0} stage'.format(stage))
+            return outputs
+
+        outputs = function(*args, **kwargs)
+        self._store(stage_folder, manifest_file, outputs)
+        return outputs
+
+    def _restore(self, stage_folder, manifest_file):
+        if not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file, 'r') as io:
+            manifest = json.load(io)
+
+        for output_file, stored_file in manifest['files']:
+            if not os.path.exists(os.path.join(stage_folder, stored_file)):
+                return None
+        for output_file, stored_file in manifest['files']:
+            stored_file = os.path.join(stage_folder, stored_file)
+            if not os.path.exists(output_file) or self.file_hash(output_file) != self.file_hash(stored_file):
+                os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok = True)
+                shutil.copy2(stored_file, output_file)
+        return manifest['outputs']
+
+    def _store(self, stage_folder, manifest_file, outputs):
+        output_files = outputs if isinstance(outputs, (list, tuple)) else [outputs]
+        os.makedirs(stage_folder, exist_ok = True)
+
+        files = []
+        for n, output_file in enumerate(output_files):
+            stored_file = '{0}_{1}'.format(n, os.path.basename(output_file))
+            shutil.copy2(output_file, os.path.join(stage_folder, stored_file))
+            files.append((output_file, stored_file))
+
+        # the manifest is written last, it marks the stage as complete
+        with open(manifest_file, 'w') as io:
+            json.dump({'outputs': outputs, 'files': files}, io)
+        return
+
+
+def run_stage(cache, stage, input_files, params, function, *args, **kwargs):
+    # runs function directly without a cache
+    if cache is None:
+        return function(*args, **kwargs)
+    return cache.run(stage, input_files, params, function, *args, **kwargs)
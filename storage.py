@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+    Ligandum
+    -----
+
+    Memory-mapped persistence of pyQms results
+
+    :license: Apache 2.0, see LICENSE.txt for more details
+
+    Authors:
+
+        * Stahl, M.
+
+"""
+import os
+import pickle
+from collections import namedtuple
+from match_store import MatchStore, PeakBuffer, write_match_stores, read_match_stores
+
+
+META_FILE = 'meta.pkl'
+
+
+def save_results(results, folder):
+    # matches go into memory-mappable arrays, keys and lookup into a small pickle
+    keys = list(results.keys())
+    peak_buffer = PeakBuffer()
+    stores = [MatchStore.from_matches(results[key]['data'], peak_buffer) for key in keys]
+    slices = write_match_stores(stores, folder)
+
+    meta = {
+        'key_fields': keys[0]._fields if len(keys) > 0 else None,
+        'keys'      : [tuple(key) for key in keys],
+        'slices'    : slices,
+        'lookup'    : getattr(results, 'lookup', None)
+    }
+    with open(os.path.join(folder, META_FILE), 'wb') as meta_file:
+        pickle.dump(meta, meta_file, protocol = pickle.HIGHEST_PROTOCOL)
+    return
+
+
+def load_results(folder, mmap_mode = 'r'):
+    with open(os.path.join(folder, META_FILE), 'rb') as meta_file:
+        meta = pickle.load(meta_file)
+
+    results = StoredResults(lookup = meta['lookup'])
+    if meta['key_fields'] is not None:
+        key_class = namedtuple('result_key', meta['key_fields'])
+        stores = read_match_stores(folder, meta['slices'], mmap_mode = mmap_mode)
+        for key, store in zip(meta['keys'], stores):
+            results[key_class(*key)] = {'data': store}
+    return results
+
+
+class StoredResults(dict):
+    # read-only stand-in for pyqms.Results loaded by load_results, offers the
+    # extract_results interface used by Ratios
+
+    def __init__(self, lookup = None):
+        self.lookup = lookup
+        return
+
+    def extract_results(
+            self,
+            molecules         = None,
+            charges           = None,
+            file_names        = None,
+            label_percentiles = None,
+            formulas          = None,
+            score_threshold   = None
+                ):
+
+        if molecules is not None:
+            molecule_formulas = set(self.lookup['molecule to formula'][molecule] for molecule in molecules)
+        for key, value in self.items():
+            if molecules is not None and key.formula not in molecule_formulas:
+                continue
+            if charges is not None and key.charge not in charges:
+                continue
+            if file_names is not None and key.file_name not in file_names:
+                continue
+            if label_percentiles is not None and key.label_percentiles not in label_percentiles:
+                continue
+            if formulas is not None and key.formula not in formulas:
+                continue
+            for i, entry in enumerate(value['data']):
+                if score_threshold is not None and (entry.score is None or entry.score < score_threshold):
+                    continue
+                yield key, i, entry
@@ -1,22 +1,35 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 
+import os
 import pickle
+import storage
 from ratios import Ratios
 
 def main():
     quant_summary = '/Users/MS/Desktop/special_projects/SMHacker/quant_summary.csv'
     rt_info_file = '/Users/MS/Desktop/special_projects/SMHacker/ligand_quant_res.csv'
     
-    results_class = pickle.load(
-        open(
-            '/Users/MS/Desktop/special_projects/SMHacker/pyQms_results.pkl',
-            'rb'
-        )
-    )
+    ratios_folder = '/Users/MS/Desktop/special_projects/SMHacker/ratios'
+    results_folder = '/Users/MS/Desktop/special_projects/SMHacker/pyQms_results'
     
-    rs = Ratios(quant_summary, rt_info_file, results_class, ['TEV_H', 'TEV_L'])
-    rs.read_and_parse_files()
+    if os.path.exists(ratios_folder):
+        # memory-mapped, match data is only read when accessed
+        rs = Ratios.load(ratios_folder)
+    else:
+        if os.path.exists(results_folder):
+            results_class = storage.load_results(results_folder)
+        else:
+            results_class = pickle.load(
+                open(
+                    '/Users/MS/Desktop/special_projects/SMHacker/pyQms_results.pkl',
+                    'rb'
+                )
+            )
+        
+        rs = Ratios(quant_summary, rt_info_file, results_class, ['TEV_H', 'TEV_L'])
+        rs.read_and_parse_files()
+        rs.save(ratios_folder)
 #     for key, value in rs.get_results_by_sequence('EVDEQMLNVQNKNSSYFVEWIPNNVK'):
 #         print(key, value)
 #     gen = rs.calculate_ratios('TEV_H', 'TEV_L', 'auc in window')
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import numpy as np
+from climber import Climber
+
+
+RT = [float(n) for n in range(10)]
+
+# apex at 4.0, half of it is reached at 3.0 and 5.0
+PEAK = [0., 1., 2., 5., 10., 6., 3., 1., 0., 0.]
+
+# a high peak at 2.0 and a small one at 8.0
+TWO_PEAKS = [10., 50., 100., 40., 5., 0., 8., 15., 20., 12.]
+
+
+def climb(profiles, evidence_rts, params = None):
+    return Climber(params).climb_profiles(profiles, evidence_rts)
+
+
+def test_climb_from_apex_to_intensity_percentile():
+    assert climb([(RT, PEAK)], [[4.2]]) == [(3., 5.)]
+    # the apex is searched around all evidences
+    assert climb([(RT, PEAK)], [[3.1, 4.8]]) == [(3., 5.)]
+    assert climb(
+        [(RT, PEAK)],
+        [[4.2]],
+        params = {'INTENSITY_PERCENTILE': 0.2, 'RT_OFFSET_TO_MS2': 1}
+    ) == [(2., 6.)]
+
+
+def test_apex_is_the_highest_point_near_the_evidences():
+    assert climb([(RT, TWO_PEAKS)], [[8.]]) == [(7., 9.)]
+    assert climb([(RT, TWO_PEAKS)], [[2.5]]) == [(1., 2.)]
+    # with a low percentile the window reaches the end of the profile
+    assert climb([(RT, TWO_PEAKS)], [[7.5]], params = {'INTENSITY_PERCENTILE': 0.05, 'RT_OFFSET_TO_MS2': 1}) == [(6., 9.)]
+
+
+def test_no_window_without_a_local_maximum_near_the_evidences():
+    rising = [float(n) for n in range(1, 11)]
+    # only the last point of the rising profile is a maximum, its half is
+    # reached at 4.0
+    assert climb(
+        [(RT, rising), (RT, rising), (RT, PEAK)],
+        [[2.], [9.], [20.]]
+    ) == [None, (4., 9.), None]
+
+
+def test_windows_end_at_the_profile_borders():
+    flat = [1.] * 10
+    assert climb([(RT, flat)], [[4.]]) == [(0., 9.)]
+
+
+def test_reversed_rt_gives_the_same_windows():
+    profiles = [(RT, PEAK), (RT, TWO_PEAKS)]
+    reversed_profiles = [(profile_rt[::-1], profile_i[::-1]) for profile_rt, profile_i in profiles]
+    evidence_rts = [[4.2], [8.]]
+    assert climb(reversed_profiles, evidence_rts) == climb(profiles, evidence_rts) == [(3., 5.), (7., 9.)]
+
+
+def test_empty_profiles_have_no_window():
+    assert climb([([], []), (RT, PEAK), ([], [])], [[4.], [4.], [4.]]) == [None, (3., 5.), None]
+    assert climb([(RT, PEAK)], [[]]) == [None]
+    assert climb([([], [])], [[4.]]) == [None]
+    assert climb([], []) == []
+
+    starts, stops = Climber().climb([], [], [0, 0, 0], [1., 2.])
+    assert np.isnan(starts).all() and np.isnan(stops).all() and len(starts) == 2
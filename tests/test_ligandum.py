@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import copy
+import pytest
+
+
+pytest.importorskip('ursgal')
+import ligandum
+
+
+def formula(molecule):
+    # stand-in for hill_notation, one formula per molecule
+    return 'formula of {0}'.format(molecule)
+
+
+def list_based_edit_molecule_list(molecule_list, evidence_lookup, labels):
+    # edit_molecule_list and check_pairs before the set based partner lookup
+    for molecule in molecule_list[:]:
+        num_of_labels = 0
+        for label in labels:
+            num_of_labels += molecule.count(label['name'])
+        if not num_of_labels == 1:
+            molecule_list.remove(molecule)
+
+    for molecule in molecule_list[:]:
+        partner_label_name = ''
+        current_label_name = ''
+        for label in labels:
+            if molecule.count(label['name']) == 0:
+                partner_label_name = label['name']
+            else:
+                current_label_name = label['name']
+        partner_molecule = molecule.replace(current_label_name, partner_label_name)
+        if not partner_molecule in molecule_list:
+            molecule_list.append(partner_molecule)
+            if molecule in evidence_lookup[formula(molecule)]:
+                trivial_names = evidence_lookup[formula(molecule)][molecule]['trivial_names'].copy()
+                trivial_names.extend({'no MS2': True})
+                evidence = evidence_lookup[formula(molecule)][molecule]['evidences'].copy()
+                evidence_lookup[formula(partner_molecule)] = {
+                    partner_molecule: {
+                        'evidences'    : evidence,
+                        'trivial_names': trivial_names
+                    }
+                }
+    return
+
+
+def test_edit_molecule_list_equals_list_based_version(monkeypatch):
+    monkeypatch.setattr(ligandum, 'hill_notation', formula)
+    molecule_list = [
+        'PEPTIDEK#TEV_H:7',
+        'PEPTIDEK#TEV_L:7',
+        'ACDEFK#TEV_L:6',
+        'ACDEFK#TEV_L:6;Oxidation:2',
+        'ELVISK#TEV_H:6;TEV_L:1',
+        'ELVISK',
+        'LIVESK#Oxidation:1;TEV_H:6',
+        'SAMPLEK#TEV_H:7',
+        'SAMPLEK#TEV_H:7'
+    ]
+    evidence_lookup = {
+        formula(molecule): {
+            molecule: {
+                'evidences'    : [{'RT': 10. + n, 'score': 0.01, 'score_field': 'PEP'}],
+                'trivial_names': ['P{0}'.format(n)]
+            }
+        }
+        for n, molecule in enumerate(molecule_list)
+        if molecule != 'ACDEFK#TEV_L:6'
+    }
+    evidence_lookup[formula('ACDEFK#TEV_L:6')] = {}
+    expected_molecule_list = list(molecule_list)
+    expected_evidence_lookup = copy.deepcopy(evidence_lookup)
+
+    ligandum.edit_molecule_list(molecule_list, evidence_lookup, ligandum.default_labels)
+    list_based_edit_molecule_list(expected_molecule_list, expected_evidence_lookup, ligandum.default_labels)
+
+    assert molecule_list == expected_molecule_list
+    assert evidence_lookup == expected_evidence_lookup
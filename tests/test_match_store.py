@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import pytest
+from match_store import match, MatchStore, PeakBuffer, write_match_stores, read_match_stores
+
+
+def synthetic_matches(spec_ids, rts):
+    return [
+        match(spec_id, rt, 0.9, None if n % 2 else 10. * n, ((500. + n, 1., 1., 500., None),))
+        for n, (spec_id, rt) in enumerate(zip(spec_ids, rts))
+    ]
+
+
+def test_matches_are_sorted_by_rt():
+    matches = synthetic_matches([3, 1, 2], [12., 10., 11.])
+    store = MatchStore.from_matches(matches, PeakBuffer())
+    assert [entry.rt for entry in store] == [10., 11., 12.]
+    # every match keeps its own peaks after sorting
+    assert list(store) == sorted(matches, key = lambda entry: entry.rt)
+
+
+def test_window_includes_both_borders():
+    matches = synthetic_matches(range(10), [10. + n * 0.5 for n in range(10)])
+    store = MatchStore.from_matches(matches, PeakBuffer())
+    assert [entry.rt for entry in store.window(11., 12.)] == [11., 11.5, 12.]
+    assert [entry.rt for entry in store.window(11.1, 11.4)] == []
+    assert list(store.window(0., 100.)) == matches
+    assert len(store.window(20., 30.)) == 0
+    assert len(store.window(12., 11.)) == 0
+
+
+def test_peaks_need_the_same_width():
+    peak_buffer = PeakBuffer()
+    peak_buffer.append([(500., 1., 1., 500., 1.)])
+    with pytest.raises(ValueError):
+        peak_buffer.append([(500., 1., 1., 500., 1., 1.)])
+    with pytest.raises(ValueError):
+        peak_buffer.append([(500., 1.)])
+
+
+def test_write_and_read_match_stores(tmpdir):
+    peak_buffer = PeakBuffer()
+    int_matches = synthetic_matches([1, 2, 3], [10., 11., 12.])
+    str_matches = synthetic_matches(['scan=4', 'scan=5'], [10., 11.])
+    stores = [
+        MatchStore.from_matches(int_matches, peak_buffer),
+        MatchStore.from_matches([], peak_buffer),
+        MatchStore.from_matches(str_matches, peak_buffer),
+        MatchStore.from_matches(int_matches[1:], peak_buffer).window(11.5, 13.)
+    ]
+    slices = write_match_stores(stores, str(tmpdir))
+    loaded_stores = read_match_stores(str(tmpdir), slices)
+
+    assert [list(store) for store in loaded_stores] == [list(store) for store in stores]
+    # integer spec_ids stay integers next to a store with string spec_ids
+    assert [type(entry.spec_id) for entry in loaded_stores[0]] == [int, int, int]
+    assert [type(entry.spec_id) for entry in loaded_stores[2]] == [str, str]
+    assert list(loaded_stores[3]) == int_matches[2:]
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import os
+import threading
+import numpy as np
+import pyqms
+import pytest
+import matcher
+
+
+MOLECULES = ['PEPTIDEK', 'ELVISLIVESK', 'ACDEFGHIK', 'LLAVVAPKR']
+CHARGES = [2, 3]
+
+
+@pytest.fixture(scope = 'module')
+def lib():
+    return pyqms.IsotopologueLibrary(molecules = MOLECULES, charges = CHARGES, verbose = False)
+
+
+def synthetic_spectra(lib, n_spectra = 40, seed = 0):
+    # isotope envelopes of every molecule eluting at different RTs plus noise
+    random_state = np.random.RandomState(seed)
+    envelopes = []
+    for formula, entry in lib.items():
+        for label_percentiles, env in entry['env'].items():
+            for charge in lib.charges:
+                envelopes.append((
+                    np.array(env[charge]['mz']),
+                    np.array(env['relabun'][:len(env[charge]['mz'])]),
+                    random_state.uniform(0, n_spectra)
+                ))
+
+    spectra = []
+    for n in range(n_spectra):
+        mz = [random_state.uniform(200., 1500., 300)]
+        i = [random_state.uniform(10., 1000., 300)]
+        for envelope_mz, envelope_i, apex in envelopes:
+            weight = np.exp(-0.5 * ((n - apex) / 3.) ** 2)
+            if weight > 0.01:
+                mz.append(envelope_mz * (1 + random_state.normal(0., 1e-6, len(envelope_mz))))
+                i.append(envelope_i * 1e6 * weight)
+        mz = np.concatenate(mz)
+        i = np.concatenate(i)
+        order = np.argsort(mz)
+        spectra.append((n + 1, n * 0.1, list(zip(mz[order].tolist(), i[order].tolist()))))
+    return spectra
+
+
+def result_data(results):
+    return {key: value['data'] for key, value in results.items()}
+
+
+def test_prefilter_keeps_results_identical(lib):
+    spectra = synthetic_spectra(lib)
+    results = matcher.match_spectra(lib, spectra, 'test.mzML', verbose = False)
+    prefiltered_results = matcher.match_spectra(
+        matcher.PrefilteredLibrary(lib),
+        spectra,
+        'test.mzML',
+        verbose = False
+    )
+
+    assert len(results) > 0
+    assert result_data(prefiltered_results) == result_data(results)
+
+
+def test_prefilter_drops_peaks_outside_library(lib):
+    prefilter = matcher.PeakPrefilter(lib)
+    spectrum = synthetic_spectra(lib, n_spectra = 1)[0][2]
+    assert len(prefilter.filter(spectrum)) < len(spectrum)
+    assert prefilter.filter([]) == []
+
+
+def test_merged_chunks_equal_serial_results(lib):
+    spectra = synthetic_spectra(lib)
+    results = matcher.match_spectra(lib, spectra, 'test.mzML', verbose = False)
+    merged = matcher.merge_results([
+        matcher.match_spectra(lib, chunk, 'test.mzML', verbose = False)
+        for chunk in matcher.iter_chunks(spectra, 7)
+    ])
+
+    assert list(merged.keys()) == list(results.keys())
+    for key, value in results.items():
+        for field in ['data', 'len_data', 'max_score', 'max_score_index']:
+            assert merged[key][field] == value[field]
+    assert merged.index == results.index
+
+
+def test_parallel_results_equal_serial_results(lib):
+    spectra = synthetic_spectra(lib)
+    results = matcher.match_spectra(lib, spectra, 'test.mzML', verbose = False)
+
+    consumed = []
+    def reader():
+        for spectrum in spectra:
+            consumed.append(spectrum)
+            yield spectrum
+
+    parallel_results = matcher.match_spectra_parallel(
+        reader(),
+        'test.mzML',
+        {'molecules': MOLECULES, 'charges': CHARGES, 'verbose': False},
+        workers    = 2,
+        chunk_size = 5
+    )
+    assert len(consumed) == len(spectra)
+    assert list(parallel_results.keys()) == list(results.keys())
+    for key, value in results.items():
+        for field in ['data', 'len_data', 'max_score', 'max_score_index']:
+            assert parallel_results[key][field] == value[field]
+    assert parallel_results.index == results.index
+    assert parallel_results.lookup == results.lookup
+
+
+RT_WINDOWS = {
+    'PEPTIDEK'   : (0.2, 1.4),
+    'ELVISLIVESK': (1.1, 2.6),
+    'ACDEFGHIK'  : (3.2, 3.9),
+    'LLAVVAPKR'  : None
+}
+
+
+def test_gated_block_molecules_match_windows():
+    library_params = {'molecules': MOLECULES, 'charges': CHARGES, 'verbose': False}
+    gated_library = matcher.RTGatedLibrary(library_params, RT_WINDOWS, block_width = 0.5)
+    for block in list(range(10)) + [3, 0, 7]:
+        expected = tuple(
+            molecule for molecule in MOLECULES
+            if RT_WINDOWS[molecule] is None or
+            int(RT_WINDOWS[molecule][0] // 0.5) <= block <= int(RT_WINDOWS[molecule][1] // 0.5)
+        )
+        assert gated_library.molecules_for_block(block) == expected
+
+
+
+def test_gated_library_keeps_only_the_current_block(lib):
+    library_params = {'molecules': MOLECULES, 'charges': CHARGES, 'verbose': False}
+    gated_library = matcher.RTGatedLibrary(library_params, RT_WINDOWS, block_width = 0.5)
+    first = gated_library.library_for_rt(0.3)
+    assert gated_library.library_for_rt(0.4) is first
+    second = gated_library.library_for_rt(3.5)
+    assert second is not first
+    assert gated_library._library is second
+
+    # blocks share the isotope envelopes of one library build
+    formulas = matcher.library_formulas(gated_library.lib, ['LLAVVAPKR', 'ACDEFGHIK'])
+    assert set(second.keys()) == formulas
+    for formula in formulas:
+        assert second[formula] is gated_library.lib[formula]
+
+
+def test_sliced_library_matches_like_the_full_library(lib):
+    spectra = synthetic_spectra(lib)
+    results = matcher.match_spectra(lib, spectra, 'test.mzML', verbose = False)
+
+    sliced_results = matcher.match_spectra(
+        matcher.slice_library(lib, set(lib.keys())),
+        spectra,
+        'test.mzML',
+        verbose = False
+    )
+    assert result_data(sliced_results) == result_data(results)
+
+    formulas = matcher.library_formulas(lib, MOLECULES[:2])
+    sliced_results = matcher.match_spectra(
+        matcher.slice_library(lib, formulas),
+        spectra,
+        'test.mzML',
+        verbose = False
+    )
+    assert result_data(sliced_results) == {
+        key: data for key, data in result_data(results).items() if key.formula in formulas
+    }
+
+
+def test_parallel_gated_results_equal_serial_gated_results(lib):
+    spectra = synthetic_spectra(lib)
+    library_params = {'molecules': MOLECULES, 'charges': CHARGES, 'verbose': False}
+    results = matcher.match_spectra(
+        matcher.RTGatedLibrary(library_params, RT_WINDOWS, block_width = 0.5),
+        spectra,
+        'test.mzML',
+        verbose = False
+    )
+    parallel_results = matcher.match_spectra_parallel(
+        iter(spectra),
+        'test.mzML',
+        library_params,
+        workers     = 2,
+        chunk_size  = 5,
+        rt_windows  = RT_WINDOWS,
+        block_width = 0.5
+    )
+    assert len(results) > 0
+    assert result_data(parallel_results) == result_data(results)
+
+
+def test_checkpoint_with_other_settings_is_ignored(lib, tmpdir):
+    spectra = synthetic_spectra(lib)
+    library_params = {'molecules': MOLECULES, 'charges': CHARGES, 'verbose': False}
+    checkpoint_file = str(tmpdir.join('checkpoint.pkl'))
+    key = matcher.checkpoint_key(library_params)
+    matcher.match_spectra_checkpointed(
+        lib,
+        spectra[:10],
+        'test.mzML',
+        checkpoint_file,
+        checkpoint_every = 10,
+        verbose          = False,
+        key              = key
+    )
+
+    assert matcher.read_checkpoint(checkpoint_file, 'test.mzML', key)[1] == 10
+    assert matcher.read_checkpoint(checkpoint_file, 'other.mzML', key) == (None, 0)
+    other_keys = [
+        matcher.checkpoint_key(dict(library_params, molecules = MOLECULES[:2])),
+        matcher.checkpoint_key(library_params, {'REL_MZ_RANGE': 1e-5}),
+        matcher.checkpoint_key(library_params, rt_windows = RT_WINDOWS),
+        matcher.checkpoint_key(library_params, prefilter = True)
+    ]
+    for other_key in other_keys:
+        assert other_key != key
+        assert matcher.read_checkpoint(checkpoint_file, 'test.mzML', other_key) == (None, 0)
+
+
+def test_spectra_folder_of_another_mzml_is_re_extracted(lib, tmpdir, monkeypatch):
+    spectra = synthetic_spectra(lib, n_spectra = 5)
+    spectra_folder = str(tmpdir.join('spectra'))
+    mzml_a = tmpdir.join('a.mzML')
+    mzml_b = tmpdir.join('b.mzML')
+    mzml_a.write('a')
+    mzml_b.write('b')
+    matcher.extract_spectra(str(mzml_a), spectra_folder, spectra = spectra)
+
+    extracted = []
+    def iter_ms1_spectra(mzml_file):
+        extracted.append(mzml_file)
+        return iter(spectra[:len(extracted)])
+    monkeypatch.setattr(matcher, 'iter_ms1_spectra', iter_ms1_spectra)
+
+    assert len(matcher.load_spectra(str(mzml_a), spectra_folder)) == 5
+    assert len(matcher.load_spectra(str(mzml_b), spectra_folder)) == 1
+    assert len(matcher.load_spectra(str(mzml_b), spectra_folder)) == 1
+    # a rewritten mzML file at the same path is extracted again
+    mzml_b.write('bb')
+    assert len(matcher.load_spectra(str(mzml_b), spectra_folder)) == 2
+    assert extracted == [str(mzml_b), str(mzml_b)]
+
+
+def test_interrupted_extraction_is_not_reused(lib, tmpdir):
+    spectra = synthetic_spectra(lib, n_spectra = 5)
+    spectra_folder = str(tmpdir.join('spectra'))
+    mzml_file = tmpdir.join('a.mzML')
+    mzml_file.write('a')
+    matcher.extract_spectra(str(mzml_file), spectra_folder, spectra = spectra)
+
+    def failing_spectra():
+        yield spectra[0]
+        raise IOError('truncated mzML')
+    with pytest.raises(IOError):
+        matcher.extract_spectra(str(mzml_file), spectra_folder, spectra = failing_spectra())
+    assert not os.path.exists(os.path.join(spectra_folder, 'source.json'))
+
+
+def isobaric_spectra(lib, apexes, n_spectra = 61):
+    # envelopes of every formula of lib eluting at each apex, RTs 0.1 min apart
+    spectra = []
+    for n in range(n_spectra):
+        rt = n * 0.1
+        peaks = []
+        for formula, entry in lib.items():
+            for label_percentiles, env in entry['env'].items():
+                for charge in lib.charges:
+                    for apex in apexes:
+                        weight = np.exp(-0.5 * ((rt - apex) / 0.2) ** 2)
+                        if weight > 0.01:
+                            for mz, relabun in zip(env[charge]['mz'], env['relabun']):
+                                peaks.append((mz, relabun * 1e6 * weight))
+        spectra.append((n + 1, rt, sorted(peaks)))
+    return spectra
+
+
+def read_rt_info_rows(results, rt_info_file):
+    results.write_rt_info_file(output_file = rt_info_file, rt_border_tolerance = 0.5, update = True)
+    with open(rt_info_file, 'r') as io:
+        return sorted(io.read().splitlines())
+
+
+def test_gated_lookup_keeps_isobaric_molecules(tmpdir):
+    molecules = ['PEPTIDEK', 'PEPTIEDK']
+    formula = 'C(40)H(65)N(9)O(16)'
+    evidence_lookup = {
+        formula: {
+            molecule: {
+                'evidences'    : [{'RT': rt, 'score': 0.01, 'score_field': 'PEP'}],
+                'trivial_names': ['protein_{0}'.format(molecule)]
+            }
+            for molecule, rt in zip(molecules, [1.0, 5.0])
+        }
+    }
+    library_params = {'molecules': molecules, 'charges': [2], 'verbose': False, 'evidences': evidence_lookup}
+    lib = pyqms.IsotopologueLibrary(**library_params)
+    assert sorted(lib.lookup['formula to molecule'][formula]) == molecules
+    spectra = isobaric_spectra(lib, [1.0, 5.0])
+
+    rt_windows = matcher.molecule_rt_windows(molecules, evidence_lookup, rt_tolerance = 0.5)
+    gated_results = matcher.match_spectra(
+        matcher.RTGatedLibrary(library_params, rt_windows),
+        spectra,
+        'test.mzML',
+        verbose = False
+    )
+    results = matcher.match_spectra(lib, spectra, 'test.mzML', verbose = False)
+
+    assert sorted(gated_results.lookup['formula to molecule'][formula]) == molecules
+    assert gated_results.lookup['formula to evidences'] == results.lookup['formula to evidences']
+    assert read_rt_info_rows(gated_results, str(tmpdir.join('gated.csv'))) == \
+        read_rt_info_rows(results, str(tmpdir.join('ungated.csv')))
+
+
+@pytest.mark.parametrize('use_process', [False, True])
+def test_pipelined_reader_stops_when_the_consumer_stops(tmpdir, monkeypatch, use_process):
+    closed_file = str(tmpdir.join('closed'))
+    def iter_ms1_spectra(mzml_file):
+        try:
+            for n in range(10000):
+                yield n + 1, n * 0.1, [(500., 1.)]
+        finally:
+            open(closed_file, 'w').close()
+    monkeypatch.setattr(matcher, 'iter_ms1_spectra', iter_ms1_spectra)
+
+    reader = matcher.PipelinedSpectrumReader('test.mzML', use_process = use_process, queue_size = 2, batch_size = 5)
+    assert [spec_id for spec_id, rt, peaks in reader] == list(range(1, 10001))
+
+    os.remove(closed_file)
+    threads = threading.active_count()
+    spectra = iter(reader)
+    assert next(spectra)[0] == 1
+    # the producer is blocked on the full queue until the consumer stops
+    spectra.close()
+    assert os.path.exists(closed_file)
+    assert threading.active_count() == threads
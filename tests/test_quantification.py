@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import numpy as np
+from quantification import coelution
+
+
+def gaussian(rt, apex, width = 0.1, height = 1e6):
+    return height * np.exp(-0.5 * ((rt - apex) / width) ** 2)
+
+
+def profiles(pairs):
+    # [(rt_a, i_a, rt_b, i_b), ...] -> coelution arguments
+    columns = []
+    for side in [0, 1]:
+        rts = [np.asarray(pair[2 * side], dtype = np.float64) for pair in pairs]
+        intensities = [np.asarray(pair[2 * side + 1], dtype = np.float64) for pair in pairs]
+        offsets = np.concatenate([[0], np.cumsum([len(rt) for rt in rts])])
+        columns.extend([np.concatenate(rts), np.concatenate(intensities), offsets])
+    return columns
+
+
+def test_identical_and_scaled_profiles_coelute():
+    rt = np.linspace(10., 11., 21)
+    pearson, overlap = coelution(*profiles([
+        (rt, gaussian(rt, 10.5), rt, gaussian(rt, 10.5)),
+        (rt, gaussian(rt, 10.5), rt, 0.1 * gaussian(rt, 10.5))
+    ]))
+    assert np.allclose(pearson, 1.)
+    assert np.allclose(overlap, 1.)
+
+
+def test_profiles_on_different_rt_grids():
+    # the same peak sampled at other RTs is put on the common grid
+    rt_a = np.linspace(10., 11., 21)
+    rt_b = np.linspace(10.013, 10.987, 15)
+    pearson, overlap = coelution(*profiles([(rt_a, gaussian(rt_a, 10.5), rt_b, gaussian(rt_b, 10.5))]))
+    assert pearson[0] > 0.95
+    assert overlap[0] > 0.9
+
+
+def test_separated_profiles_do_not_coelute():
+    rt = np.linspace(10., 12., 41)
+    pearson, overlap = coelution(*profiles([(rt, gaussian(rt, 10.5), rt, gaussian(rt, 11.5))]))
+    assert pearson[0] < 0.
+    assert overlap[0] < 0.01
+
+
+def test_empty_and_flat_profiles_give_nan():
+    rt = np.linspace(10., 11., 21)
+    pearson, overlap = coelution(*profiles([
+        (rt, gaussian(rt, 10.5), [], []),
+        ([], [], [], []),
+        (rt, np.full(len(rt), 5.), rt, gaussian(rt, 10.5)),
+        (rt, gaussian(rt, 10.5), rt, gaussian(rt, 10.5))
+    ]))
+    assert np.isnan(pearson[:3]).all()
+    assert np.isnan(overlap[:2]).all()
+    # a flat profile still overlaps, the other pairs of the batch are unaffected
+    assert 0. < overlap[2] < 1.
+    assert np.isclose(pearson[3], 1.)
+    assert np.isclose(overlap[3], 1.)
+
+    pearson, overlap = coelution(*profiles([([], [], [], [])]))
+    assert np.isnan(pearson).all() and np.isnan(overlap).all()
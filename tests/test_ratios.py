@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+import os
+import pytest
+from match_store import match, MatchStore, PeakBuffer
+from collections import namedtuple
+from ratios import Ratios, CURATION_KEY, CURATION_FIELDS, LABELS_KEY, split_molecule, index_results
+
+
+pytest.importorskip('matplotlib')
+
+
+def synthetic_ratios(n_keys):
+    ratios = Ratios(labels = ['TEV_H', 'TEV_L'])
+    peak_buffer = PeakBuffer()
+    for n in range(n_keys):
+        sequence = 'PEPTIDE{0}K'.format('A' * n)
+        for label in ['TEV_H', 'TEV_L']:
+            matches = [match(m, 10. + m * 0.1, 0.9, 100. * m, [(500., 1., 1., 500., 1.)]) for m in range(10)]
+            r_key = ratios.add_body(
+                (sequence, '2', str(len(sequence)), ''),
+                label,
+                {
+                    'start (min)'    : '10',
+                    'stop (min)'     : '11',
+                    'evidences (min)': 'x@10.5',
+                    'has_MS2_id'     : True,
+                    'trivial_name(s)': 'P1',
+                    'data'           : MatchStore.from_matches(matches, peak_buffer),
+                    'len_data'       : len(matches)
+                }
+            )
+        ratios[r_key][CURATION_KEY] = CURATION_FIELDS.copy()
+    return ratios
+
+
+def test_parallel_plots_one_file_per_key(tmpdir):
+    ratios = synthetic_ratios(8)
+    file_name = os.path.join(str(tmpdir), 'plot_{0}_{1}.pdf')
+    written_files = ratios.plot_pairs_batch(
+        list(ratios.keys()),
+        file_name,
+        {'TEV_H': 0, 'TEV_L': 1},
+        one_file_per_key = True,
+        workers          = 2,
+        backend          = 'matplotlib'
+    )
+
+    assert sorted(written_files) == sorted(file_name.format(key[0], key[1]) for key in ratios.keys())
+    assert all(os.path.exists(written_file) for written_file in written_files)
+    # every key got its own plot, no page file is left
+    assert sorted(os.listdir(str(tmpdir))) == sorted(os.path.basename(written_file) for written_file in written_files)
+
+
+def test_coelution_curation_is_opt_in(capsys):
+    ratios = synthetic_ratios(3)
+    keys = list(ratios.keys())
+    # the light profile of the last key falls while the heavy one rises
+    matches = [match(m, 10. + m * 0.1, 0.9, 100. * (10 - m), [(500., 1., 1., 500., 1.)]) for m in range(10)]
+    ratios[keys[-1]][LABELS_KEY]['TEV_L']['data'] = MatchStore.from_matches(matches, PeakBuffer())
+
+    ratios.curate_pairs()
+    assert all(ratios[key][CURATION_KEY]['coelutes'] is None for key in keys)
+    assert all(ratios._collect_plot_data(key) is not None for key in keys)
+
+    ratios.curate_pairs(min_pearson = 0.8)
+    assert [ratios[key][CURATION_KEY]['coelutes'] for key in keys] == [True, True, False]
+    assert ratios._collect_plot_data(keys[-1]) is None
+    assert '1 of 3 pairs do not coelute' in capsys.readouterr().out
+
+    ratios.curate_pairs()
+    assert ratios[keys[-1]][CURATION_KEY]['coelutes'] is None
+
+
+def test_protein_index_keeps_every_key_once():
+    ratios = synthetic_ratios(4)
+    keys = list(ratios.keys())
+    # both labels of every key carry the trivial name
+    assert [key for key, labels in ratios.get_results_by_protein('P1')] == keys
+    assert list(ratios.get_results_by_protein('P2')) == []
+    assert sorted(ratios.get_labelled_sites('P1')) == sorted((key.sequence, key.label_position) for key in keys)
+
+
+def test_ratio_batch_parses_quant_fields_once():
+    ratios = Ratios(labels = ['TEV_H', 'TEV_L'])
+    values = {
+        'A': ('10', '5'),
+        'B': ('3', ''),
+        'C': ('0', '0'),
+        'D': ('x', '2')
+    }
+    for sequence, label_values in values.items():
+        for label, value in zip(['TEV_H', 'TEV_L'], label_values):
+            ratios.add_body((sequence, '2', '1', ''), label, {'max I in window': value})
+    ratios.add_body(('E', '2', '1', ''), 'TEV_H', {'max I in window': '4'})
+
+    assert dict((key.sequence, ratio) for key, ratio in ratios.calculate_ratios('TEV_H', 'TEV_L', 'max I in window')) == {
+        'A': 2.0,
+        'B': 20.0,
+        'C': 0.0,
+        'D': 0.0,
+        'E': 20.0
+    }
+    key_list = [key for key in ratios.keys() if key.sequence in ('E', 'A')][::-1]
+    batch = ratios.calculate_ratio_batch([('TEV_H', 'TEV_L')], ['max I in window'], key_list = key_list)
+    assert batch[('TEV_H', 'TEV_L', 'max I in window')].ratio.tolist() == [20.0, 2.0]
+    assert batch[('TEV_H', 'TEV_L', 'max I in window')].numerator.tolist() == [4.0, 10.0]
+
+    # keys added later are part of the next batch
+    ratios.add_body(('F', '2', '1', ''), 'TEV_H', {'max I in window': '6'})
+    ratios.add_body(('F', '2', '1', ''), 'TEV_L', {'max I in window': '3'})
+    assert dict(
+        (key.sequence, ratio) for key, ratio in ratios.calculate_ratios('TEV_H', 'TEV_L', 'max I in window')
+    )['F'] == 2.0
+
+
+def test_split_molecule():
+    labels = ('TEV_H', 'TEV_L')
+    assert split_molecule('PEPTIDEK#TEV_H:8', labels) == ('PEPTIDEK', 'TEV_H', '8', '')
+    assert split_molecule('PEPTIDEK#Oxidation:1;TEV_L:8', labels) == ('PEPTIDEK', 'TEV_L', '8', 'Oxidation:1')
+    assert split_molecule('PEPTIDEK#TEV_H:12;Oxidation:1', labels) == ('PEPTIDEK', 'TEV_H', '12', 'Oxidation:1')
+    assert split_molecule(
+        'PEPTIDEK#Oxidation:1;TEV_H:8;Carbamidomethyl:3',
+        labels
+    ) == ('PEPTIDEK', 'TEV_H', '8', 'Oxidation:1;Carbamidomethyl:3')
+    # without a label the position is -1
+    assert split_molecule('PEPTIDEK#Oxidation:1', labels) == ('PEPTIDEK', None, -1, 'Oxidation:1')
+    assert split_molecule('PEPTIDEK#', labels) == ('PEPTIDEK', None, -1, '')
+    # a label name within another modification is not a label
+    assert split_molecule('PEPTIDEK#XTEV_H:8', labels) == ('PEPTIDEK', None, -1, 'XTEV_H:8')
+
+
+def test_split_molecule_drops_trailing_semicolons():
+    labels = ('TEV_H', 'TEV_L')
+    assert split_molecule('PEPTIDEK#TEV_H:8;', labels) == ('PEPTIDEK', 'TEV_H', '8', '')
+    assert split_molecule('PEPTIDEK#Oxidation:1;TEV_H:8;', labels) == ('PEPTIDEK', 'TEV_H', '8', 'Oxidation:1')
+    # the former Ratios._split_molecule kept this one as 'Oxidation:1;'
+    assert split_molecule('PEPTIDEK#TEV_H:8;Oxidation:1;', labels) == ('PEPTIDEK', 'TEV_H', '8', 'Oxidation:1')
+
+
+def test_index_results_groups_matches_by_file_formula_and_charge():
+    result_key = namedtuple('result_key', ['file_name', 'label_percentiles', 'formula', 'charge'])
+
+    class Results(object):
+
+        def __init__(self, entries):
+            self.entries = entries
+
+        def extract_results(self, **kwargs):
+            for key, entry in self.entries:
+                yield key, 0, entry
+
+    a2 = result_key('a.mzML', (), 'C(1)', 2)
+    a3 = result_key('a.mzML', (), 'C(1)', 3)
+    b2 = result_key('b.mzML', (), 'C(1)', 2)
+    entries = [(a2, 'm1'), (a3, 'm2'), (b2, 'm3'), (a2, 'm4')]
+    assert index_results(Results(entries)) == {
+        ('a.mzML', 'C(1)', 2): ['m1', 'm4'],
+        ('a.mzML', 'C(1)', 3): ['m2'],
+        ('b.mzML', 'C(1)', 2): ['m3']
+    }